@@ -1,11 +1,28 @@
-from flask import Flask, render_template, request, redirect, session, send_file
-import sqlite3, qrcode, datetime, csv, io, os, base64
+from flask import Flask, render_template, request, redirect, session, g, jsonify, has_app_context, Response, stream_with_context
+import sqlite3, datetime, calendar, os, sys, hmac, hashlib, json, threading, time
+import contextlib
+import re
+import click
 import urllib.parse
 from datetime import timedelta
-from dotenv import load_dotenv
+from db_pool import ConnectionPool
+from attendance_repo import AttendanceRepository, ARCHIVE_TERM, ARCHIVE_ALL
+from ingest import WriteBehindQueue
+import io
+from qr_render import QRCache, MIMETYPES, ERROR_LEVELS
+from live import LiveAttendance
+from metrics import Registry, SlowLog
+from view_cache import ResponseCache, SQLiteGenerations
+from scan_guard import ScanGuard, MemoryGuardStore, SQLiteGuardStore
+from qr_tokens import issue_token, step_token, verify_token, InvalidToken, TokenExpired
 
-# Load environment variables
-load_dotenv()
+# Load environment variables. Heavy modules (qrcode/Pillow, the export
+# and import encoders) are imported by the routes that use them, so a cold
+# start only pays for what its first request needs. Vercel provides the
+# environment itself, so .env isn't looked for there.
+if not os.environ.get("VERCEL"):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "secret123")
@@ -14,35 +31,286 @@ app.permanent_session_lifetime = timedelta(days=1)
 # Database configuration
 USE_POSTGRES = os.environ.get("DATABASE_URL") is not None
 
-def log(msg: str):
+# Connection pool configuration
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+DB_POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", "30"))
+
+# Optional write-behind mode for /scan: marks are committed in batches by a
+# background writer instead of one commit per request
+SCAN_WRITE_BEHIND = os.environ.get("SCAN_WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+SCAN_BATCH_MAX_SIZE = int(os.environ.get("SCAN_BATCH_MAX_SIZE", "100"))
+SCAN_BATCH_MAX_DELAY_MS = float(os.environ.get("SCAN_BATCH_MAX_DELAY_MS", "50"))
+SCAN_BATCH_TIMEOUT = float(os.environ.get("SCAN_BATCH_TIMEOUT", "10"))
+
+# SQLite engine profile, applied to every connection (see _open_connection)
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "20000"))
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # readers no longer block the writer (or vice versa)
+    "PRAGMA synchronous=NORMAL",  # WAL stays durable across app crashes; fsync at checkpoints
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+    f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+)
 
-    import sys
+# Prepare hot statements on each Postgres connection. Off by default: the
+# Supabase transaction pooler does not keep prepared statements.
+DB_PREPARED_STATEMENTS = os.environ.get("DB_PREPARED_STATEMENTS", "").lower() in ("1", "true", "yes")
+
+def log(msg: str):
     try:
         print(msg, file=sys.stderr, flush=True)
-        print(msg, flush=True)
     except Exception:
         pass
 
-def get_db_connection():
-    """Get database connection based on environment"""
+# ---------- METRICS ----------
+# Served at /metrics (see below). Query timings come from attendance_db,
+# pool waits from the pool and render times from qr_cache through the
+# callbacks they are created with.
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG_INTERVAL = float(os.environ.get("SLOW_QUERY_LOG_INTERVAL", "60"))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+metrics = Registry()
+REQUEST_SECONDS = metrics.histogram("http_request_duration_seconds", "Time to produce a response",
+                                    ("route", "method", "status"))
+REQUEST_QUERIES = metrics.histogram("http_request_db_queries", "Database statements run per request", ("route",),
+                                    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+REQUEST_DB_SECONDS = metrics.histogram("http_request_db_seconds", "Database time per request", ("route",))
+QUERY_SECONDS = metrics.histogram("db_query_duration_seconds", "Database statement time", ("statement",))
+POOL_WAIT_SECONDS = metrics.histogram("db_pool_wait_seconds", "Time waiting to check out a pooled connection")
+QR_RENDER_SECONDS = metrics.histogram("qr_render_seconds", "QR image render time on a cache miss", ("format",))
+SCAN_OUTCOMES = metrics.counter("scan_outcomes_total", "Scan attempts by outcome", ("outcome",))
+slow_queries = SlowLog(SLOW_QUERY_MS / 1000.0, SLOW_QUERY_LOG_INTERVAL, log)
+
+_QUERY_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+(\w+)", re.IGNORECASE)
+
+def observe_query(name, sql, seconds):
+    """attendance_db callback: time one statement and count it against the request"""
+    if name is None:
+        # Ad-hoc SQL is labelled by verb and first table, e.g. "select attendance"
+        table = _QUERY_TABLE.search(sql)
+        name = sql.split(None, 1)[0].lower() + (f" {table.group(1)}" if table else "")
+    QUERY_SECONDS.observe(seconds, name)
+    if has_app_context():
+        g.db_queries = g.get("db_queries", 0) + 1
+        g.db_seconds = g.get("db_seconds", 0.0) + seconds
+    slow_queries.check(name, seconds, " ".join(sql.split())[:300])
+
+def sqlite_path():
+    # For local development, use /tmp or current directory
+    return os.environ.get("SQLITE_PATH") or ("/tmp/attendance.db" if os.path.exists("/tmp") else "attendance.db")
+
+def sqlite_archive_path():
+    # Archived terms live next to the main database unless placed elsewhere
+    return os.environ.get("SQLITE_ARCHIVE_PATH") or os.path.splitext(sqlite_path())[0] + "_archive.db"
+
+def _open_connection():
+    """Open a new raw database connection based on environment"""
     if USE_POSTGRES:
         try:
             import psycopg2
             log("DB: connecting to Postgres via DATABASE_URL")
             return psycopg2.connect(os.environ.get("DATABASE_URL"))
         except Exception as e:
-            print(f"PostgreSQL connection error: {e}")
+            log(f"PostgreSQL connection error: {e}")
             raise
     else:
-        # For local development, use /tmp or current directory
-        db_path = "/tmp/attendance.db" if os.path.exists("/tmp") else "attendance.db"
+        db_path = sqlite_path()
         log(f"DB: using SQLite at {db_path}")
-        return sqlite3.connect(db_path)
+        # Pooled connections are handed between request threads
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0)
+        # Attached first so the pragmas below apply to the archive as well
+        conn.execute("ATTACH DATABASE ? AS archive", (sqlite_archive_path(),))
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+_pool = None
+
+# All attendance SQL, compiled for the configured backend
+attendance_db = AttendanceRepository(USE_POSTGRES, prepare=DB_PREPARED_STATEMENTS, log=log, observe=observe_query)
+
+def get_pool():
+    """Create the connection pool lazily so cold starts don't open connections"""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(_open_connection, max_size=DB_POOL_SIZE,
+                               timeout=DB_POOL_TIMEOUT, max_idle=DB_POOL_MAX_IDLE, log=log,
+                               on_checkout=POOL_WAIT_SECONDS.observe)
+    return _pool
+
+def get_db_connection():
+    """Check out a pooled database connection.
+
+    Inside a request the connection is bound to the app context, so repeated
+    calls reuse it and it is returned to the pool at teardown even if the
+    route never calls close(). conn.close() returns it to the pool early.
+    """
+    if not has_app_context():
+        return get_pool().checkout()
+    conn = g.get("db_conn")
+    if conn is None or conn.released:
+        conn = get_pool().checkout()
+        g.db_conn = conn
+    return conn
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    conn = g.pop("db_conn", None)
+    if conn is not None:
+        conn.close()
+
+# SQLite allows one writer at a time. Instead of letting request threads race
+# for the file lock (and fail with "database is locked"), every write goes
+# through one dedicated connection, one transaction at a time, while reads
+# keep using the pool and run concurrently under WAL.
+_sqlite_writer = None
+_sqlite_write_lock = threading.Lock()
+
+@contextlib.contextmanager
+def db_writer():
+    """Cursor for one write transaction; commits on success, rolls back on error"""
+    if USE_POSTGRES:
+        conn = get_db_connection()
+        try:
+            yield conn.cursor()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return
+
+    global _sqlite_writer
+    with _sqlite_write_lock:
+        if _sqlite_writer is None:
+            _sqlite_writer = _open_connection()
+        c = _sqlite_writer.cursor()
+        # Take the write lock up front (waiting out other processes via
+        # busy_timeout) so the transaction can't fail halfway on upgrade
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            yield c
+            _sqlite_writer.commit()
+        except Exception:
+            _sqlite_writer.rollback()
+            raise
+
+# ---------- DATES ----------
+# attendance.date and .time are DATE/TIME columns. Values arriving in forms
+# and query strings are checked here and passed on as ISO strings.
+
+# How far a phone's local date may be from the server's (timezones)
+SCAN_CLOCK_SKEW_DAYS = 1
+
+def parse_date(value):
+    """'YYYY-MM-DD' for a valid date string, else None"""
+    try:
+        return datetime.date.fromisoformat((value or '').strip()).isoformat()
+    except ValueError:
+        return None
+
+def parse_time(value):
+    """'HH:MM:SS' for a valid time string, else None"""
+    try:
+        t = datetime.time.fromisoformat((value or '').strip())
+    except ValueError:
+        return None
+    return t.replace(microsecond=0, tzinfo=None).isoformat()
+
+def date_filters(args):
+    """date_from/date_to filters from ?date_from=, ?date_to= and ?month=YYYY-MM"""
+    date_from = parse_date(args.get("date_from")) or ''
+    date_to = parse_date(args.get("date_to")) or ''
+    first = parse_date(f"{args.get('month') or ''}-01")
+    if first:
+        # A month narrows whatever range was also given
+        year, month = int(first[:4]), int(first[5:7])
+        last = datetime.date(year, month, calendar.monthrange(year, month)[1]).isoformat()
+        date_from = max(date_from, first)
+        date_to = min(date_to, last) if date_to else last
+    return {"date_from": date_from, "date_to": date_to}
 
 # ---------- DATABASE SETUP ----------
+# SQLite has no date types; the CHECKs hold columns to ISO date/time text.
+# date() alone passes '2025-02-30' through, so a value must also survive
+# being normalized ('+0 days' rolls it over to March).
+SQLITE_VALID_DATE = "date IS date(date, '+0 days')"
+SQLITE_VALID_TIME = "time IS time(time, '+0 seconds')"
+SQLITE_ATTENDANCE_COLUMNS = f"""
+    roll TEXT,
+    date DATE CHECK ({SQLITE_VALID_DATE}),
+    time TIME CHECK ({SQLITE_VALID_TIME}),
+    subject TEXT,
+    branch TEXT,
+    id INTEGER PRIMARY KEY,
+    deleted_at INTEGER
+"""
+
+STUDENTS_TABLE = """
+CREATE TABLE IF NOT EXISTS students(
+    roll TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    branch TEXT
+)
+"""
+
+def migrate_names_to_students(c):
+    """Fill the roster from the name column of an older attendance table,
+    keeping the most recently recorded name and branch of each roll"""
+    # Legacy SQLite tables may predate the id column; rowid orders them the same
+    key = "id" if USE_POSTGRES else "rowid"
+    c.execute(f"""
+        INSERT INTO students (roll, name, branch)
+        SELECT roll, COALESCE(name, ''), branch FROM attendance
+        WHERE {key} IN (SELECT MAX({key}) FROM attendance WHERE roll IS NOT NULL GROUP BY roll)
+        ON CONFLICT (roll) DO NOTHING
+    """)
+    log(f"INIT: moved {c.rowcount} student names into the roster")
+
+# ---------- SCHEMA ----------
+# init_db() builds the schema and upgrades any older layout. It is
+# idempotent but touches every table, so each successful run is recorded in
+# schema_version and startup only compares that number with SCHEMA_VERSION.
+# Bump SCHEMA_VERSION whenever init_db() changes.
+SCHEMA_VERSION = 4
+# With AUTO_MIGRATE=0 startup skips even the version check; the schema is
+# then brought up to date by `flask --app app1 migrate` at deploy time.
+AUTO_MIGRATE = os.environ.get("AUTO_MIGRATE", "1").lower() in ("1", "true", "yes")
+
+def schema_version(c):
+    """Schema version recorded in the database, 0 if none"""
+    if USE_POSTGRES:
+        c.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    else:
+        c.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='schema_version'")
+    if not c.fetchone()[0]:
+        return 0
+    c.execute("SELECT MAX(version) FROM schema_version")
+    return c.fetchone()[0] or 0
+
+def migrate():
+    """Run init_db() unless the database is already at SCHEMA_VERSION; returns the version before"""
+    conn = get_db_connection()
+    version = schema_version(conn.cursor())
+    conn.close()
+    if version < SCHEMA_VERSION:
+        log(f"INIT: migrating schema from version {version} to {SCHEMA_VERSION}")
+        init_db()
+    return version
+
 def init_db():
+    # Migrations may change the attendance columns; drop any cached statements
+    attendance_db.invalidate_schema()
     conn = get_db_connection()
     c = conn.cursor()
+    if USE_POSTGRES:
+        # Processes starting together migrate one after another
+        c.execute("SELECT pg_advisory_xact_lock(hashtext('attendance_schema'))")
 
     if USE_POSTGRES:
         # PostgreSQL syntax
@@ -56,14 +324,66 @@ def init_db():
         c.execute("""
         CREATE TABLE IF NOT EXISTS attendance(
             roll TEXT,
-            name TEXT,
-            date TEXT,
-            time TEXT,
+            date DATE,
+            time TIME,
             subject TEXT,
-            branch TEXT
+            branch TEXT,
+            id BIGSERIAL PRIMARY KEY,
+            deleted_at BIGINT
         )
         """)
 
+        # Bring tables created by older versions up to date
+        c.execute("ALTER TABLE attendance ADD COLUMN IF NOT EXISTS subject TEXT")
+        c.execute("ALTER TABLE attendance ADD COLUMN IF NOT EXISTS branch TEXT")
+        c.execute("ALTER TABLE attendance ADD COLUMN IF NOT EXISTS id BIGSERIAL PRIMARY KEY")
+
+        c.execute(STUDENTS_TABLE)
+        c.execute("SELECT column_name, data_type FROM information_schema.columns WHERE table_name='attendance'")
+        types = dict(c.fetchall())
+        # Older tables kept date and time as text; values that don't parse become
+        # NULL, as with SQLite's date()/time(). A well-formed but impossible value
+        # such as '2024-02-30' or '25:61' still fails the cast, so cast through
+        # session-local functions that turn the error into NULL.
+        typed_dates = types['date'] == 'date'
+        if not typed_dates:
+            for name, kind in (("try_date", "DATE"), ("try_time", "TIME")):
+                c.execute(f"""
+                    CREATE OR REPLACE FUNCTION pg_temp.{name}(value TEXT) RETURNS {kind} AS $$
+                    BEGIN
+                        RETURN value::{kind};
+                    EXCEPTION WHEN others THEN
+                        RETURN NULL;
+                    END
+                    $$ LANGUAGE plpgsql
+                """)
+            c.execute(r"""
+                ALTER TABLE attendance
+                ALTER COLUMN date TYPE DATE
+                    USING CASE WHEN date ~ '^\d{4}-\d{2}-\d{2}$' THEN pg_temp.try_date(date) END,
+                ALTER COLUMN time TYPE TIME
+                    USING CASE WHEN time ~ '^([01]?\d|2[0-3]):\d{2}(:\d{2}(\.\d+)?)?$' THEN pg_temp.try_time(time) END
+            """)
+            log("INIT: converted attendance date/time to DATE/TIME")
+        if 'name' in types:
+            migrate_names_to_students(c)
+            c.execute("DROP INDEX IF EXISTS attendance_name")
+            c.execute("ALTER TABLE attendance DROP COLUMN name")
+
+        # Trigram index for name search; pg_trgm may need a privileged role,
+        # without it searches still work through a sequential scan of students
+        c.execute("SAVEPOINT trgm")
+        try:
+            c.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            c.execute("CREATE INDEX IF NOT EXISTS students_name_trgm ON students USING gin (name gin_trgm_ops)")
+            c.execute("RELEASE SAVEPOINT trgm")
+        except Exception as e:
+            c.execute("ROLLBACK TO SAVEPOINT trgm")
+            log(f"INIT: pg_trgm unavailable, name search is unindexed ({str(e).splitlines()[0]})")
+
+        c.execute("SELECT 1 FROM pg_indexes WHERE tablename='attendance' AND indexname='attendance_mark_key'")
+        has_mark_key = c.fetchone() is not None
+
         # Insert default admin (use ON CONFLICT for PostgreSQL)
         c.execute("""
             INSERT INTO admin (username, password) 
@@ -79,24 +399,17 @@ def init_db():
         )
         """)
 
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS attendance(
-            roll TEXT,
-            name TEXT,
-            date TEXT,
-            time TEXT
-        )
-        """)
+        c.execute(f"CREATE TABLE IF NOT EXISTS attendance({SQLITE_ATTENDANCE_COLUMNS})")
+        c.execute(STUDENTS_TABLE)
 
-        # Migrate existing old table (with id) to new schema while preserving data
         c.execute("PRAGMA table_info(attendance)")
-        cols = [r[1] for r in c.fetchall()]
-        
-        if 'id' in cols:
-            c.execute("CREATE TABLE IF NOT EXISTS attendance_new(roll TEXT, name TEXT, date TEXT, time TEXT)")
-            c.execute("INSERT INTO attendance_new(roll,name,date,time) SELECT roll,name,date,time FROM attendance")
-            c.execute("DROP TABLE attendance")
-            c.execute("ALTER TABLE attendance_new RENAME TO attendance")
+        info = c.fetchall()
+        cols = [r[1] for r in info]
+        pk_cols = [r[1] for r in info if r[5]]
+        c.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='attendance'")
+        # Tables from before the '+0 days' CHECK may hold impossible dates
+        typed_dates = ({r[1]: r[2] for r in info}.get('date') == 'DATE'
+                       and SQLITE_VALID_DATE in c.fetchone()[0])
 
         # Ensure subject column exists; if not, add it
         if 'subject' not in cols:
@@ -112,6 +425,28 @@ def init_db():
             except Exception:
                 pass
 
+        # Names now live in the students roster
+        if 'name' in cols:
+            migrate_names_to_students(c)
+
+        # Rebuild old tables (no key, a legacy non-key id column, a name
+        # column or unchecked dates) with an integer primary key while
+        # preserving data, ids and insertion order. Dates and times are
+        # normalized on the way; values that don't parse, or name a day or
+        # time that doesn't exist, become NULL.
+        if pk_cols != ['id'] or 'name' in cols or not typed_dates:
+            kept = "".join(f"{col}," for col in ('id', 'deleted_at')
+                           if col in cols and (col != 'id' or pk_cols == ['id']))
+            c.execute("DROP TABLE IF EXISTS attendance_new")
+            c.execute(f"CREATE TABLE attendance_new({SQLITE_ATTENDANCE_COLUMNS})")
+            c.execute(f"""INSERT INTO attendance_new({kept}roll,date,time,subject,branch)
+                          SELECT {kept}roll,
+                                 CASE WHEN date(date) IS date(date, '+0 days') THEN date(date) END,
+                                 CASE WHEN time(time) IS time(time, '+0 seconds') THEN time(time) END,
+                                 subject,branch FROM attendance ORDER BY rowid""")
+            c.execute("DROP TABLE attendance")
+            c.execute("ALTER TABLE attendance_new RENAME TO attendance")
+
         c.execute("INSERT OR IGNORE INTO admin VALUES('admin','admin123')")
         
         # Normalize legacy subject value 'P&S' to 'P and S'
@@ -120,14 +455,200 @@ def init_db():
         except Exception:
             pass
 
+        c.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='attendance_mark_key'")
+        has_mark_key = c.fetchone() is not None
+
+        # FTS5 trigram index for name search, kept in step by triggers
+        try:
+            c.execute("SELECT 1 FROM sqlite_master WHERE name='students_fts'")
+            if c.fetchone() is None:
+                c.execute("""CREATE VIRTUAL TABLE students_fts USING fts5(
+                                 name, content='students', content_rowid='rowid', tokenize='trigram')""")
+                c.execute("""CREATE TRIGGER students_fts_insert AFTER INSERT ON students BEGIN
+                                 INSERT INTO students_fts(rowid, name) VALUES (new.rowid, new.name); END""")
+                c.execute("""CREATE TRIGGER students_fts_delete AFTER DELETE ON students BEGIN
+                                 INSERT INTO students_fts(students_fts, rowid, name)
+                                 VALUES ('delete', old.rowid, old.name); END""")
+                c.execute("""CREATE TRIGGER students_fts_update AFTER UPDATE OF name ON students BEGIN
+                                 INSERT INTO students_fts(students_fts, rowid, name)
+                                 VALUES ('delete', old.rowid, old.name);
+                                 INSERT INTO students_fts(rowid, name) VALUES (new.rowid, new.name); END""")
+                c.execute("INSERT INTO students_fts(students_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError as e:
+            log(f"INIT: FTS5 trigram tokenizer unavailable, name search is unindexed ({e})")
+
+    # Soft deletes (see DELETING): deleted_at is set on tombstoned rows, and
+    # the live-table indexes are partial on deleted_at IS NULL so a deleted
+    # mark neither blocks a new scan nor slows paging. Older tables get the
+    # column and have their indexes recreated below.
+    if USE_POSTGRES:
+        c.execute("SELECT 1 FROM information_schema.columns WHERE table_name='attendance' AND column_name='deleted_at'")
+        has_tombstones = c.fetchone() is not None
+    else:
+        c.execute("PRAGMA table_info(attendance)")
+        has_tombstones = 'deleted_at' in [r[1] for r in c.fetchall()]
+    if not has_tombstones:
+        c.execute("ALTER TABLE attendance ADD COLUMN deleted_at BIGINT")
+        for index in ("attendance_mark_key", "attendance_recent", "attendance_subject_branch_recent"):
+            c.execute(f"DROP INDEX IF EXISTS {index}")
+        has_mark_key = False
+
+    # One mark per (roll, date, subject, branch). Legacy data may contain
+    # duplicates, so keep the earliest row of each group before adding the index.
+    if not has_mark_key:
+        c.execute("""
+            DELETE FROM attendance WHERE deleted_at IS NULL AND id NOT IN (
+                SELECT MIN(id) FROM attendance WHERE deleted_at IS NULL
+                GROUP BY roll, date, COALESCE(subject, ''), COALESCE(branch, '')
+            )
+        """)
+        if c.rowcount and c.rowcount > 0:
+            log(f"INIT: removed {c.rowcount} duplicate attendance rows")
+        c.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS attendance_mark_key
+            ON attendance (roll, date, COALESCE(subject, ''), COALESCE(branch, '')) WHERE deleted_at IS NULL
+        """)
+
+    # Newest-first keyset paging for /view, with and without subject/branch filters
+    c.execute("CREATE INDEX IF NOT EXISTS attendance_recent ON attendance (date, time, id) WHERE deleted_at IS NULL")
+    c.execute("""CREATE INDEX IF NOT EXISTS attendance_subject_branch_recent
+                 ON attendance (subject, branch, date, time, id) WHERE deleted_at IS NULL""")
+    # ...and for the legacy rows without a date or time, listed after them
+    c.execute("""CREATE INDEX IF NOT EXISTS attendance_undated
+                 ON attendance (id) WHERE deleted_at IS NULL AND (date IS NULL OR time IS NULL)""")
+    # Undo and purge find a deletion's rows by stamp
+    c.execute("CREATE INDEX IF NOT EXISTS attendance_deleted ON attendance (deleted_at) WHERE deleted_at IS NOT NULL")
+    # Exact name lookups (student_view)
+    c.execute("CREATE INDEX IF NOT EXISTS students_lower_name ON students (lower(name))")
+
+    # Pre-aggregated statistics, kept in step with attendance by every write.
+    # NULL subject/branch are stored as '' so they can be part of the key.
+    if USE_POSTGRES:
+        c.execute("SELECT to_regclass('attendance_totals') IS NOT NULL")
+        has_stats = c.fetchone()[0]
+    else:
+        c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='attendance_totals'")
+        has_stats = c.fetchone() is not None
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS attendance_totals(
+        roll TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        branch TEXT NOT NULL,
+        attended INTEGER NOT NULL,
+        PRIMARY KEY (roll, subject, branch)
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS sessions_held(
+        subject TEXT NOT NULL,
+        branch TEXT NOT NULL,
+        date DATE NOT NULL,
+        marks INTEGER NOT NULL,
+        PRIMARY KEY (subject, branch, date)
+    )
+    """)
+    if not typed_dates:
+        # Recount from the converted attendance dates
+        c.execute("DELETE FROM sessions_held")
+        if USE_POSTGRES:
+            c.execute("ALTER TABLE sessions_held ALTER COLUMN date TYPE DATE USING date::date")
+        has_stats = False
+    if not has_stats:
+        attendance_db.rebuild_stats(c)
+
+    # Semester archive (see archive_term); one partition per term on Postgres,
+    # a table in the attached archive database on SQLite
+    if USE_POSTGRES:
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS attendance_archive(
+            term TEXT NOT NULL,
+            id BIGINT NOT NULL,
+            roll TEXT,
+            date DATE,
+            time TIME,
+            subject TEXT,
+            branch TEXT,
+            PRIMARY KEY (term, id)
+        ) PARTITION BY LIST (term)
+        """)
+        # Partition pruning picks the term; these order rows within it
+        c.execute("CREATE INDEX IF NOT EXISTS attendance_archive_recent ON attendance_archive (date, time, id)")
+        c.execute("""CREATE INDEX IF NOT EXISTS attendance_archive_subject_branch_recent
+                     ON attendance_archive (subject, branch, date, time, id)""")
+    else:
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS archive.attendance_archive(
+            term TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            roll TEXT,
+            date DATE,
+            time TIME,
+            subject TEXT,
+            branch TEXT,
+            PRIMARY KEY (term, id)
+        )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS archive.attendance_archive_recent ON attendance_archive (term, date, time, id)")
+        c.execute("""CREATE INDEX IF NOT EXISTS archive.attendance_archive_subject_branch_recent
+                     ON attendance_archive (term, subject, branch, date, time, id)""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS archive_terms(
+        term TEXT PRIMARY KEY,
+        cutoff DATE NOT NULL,
+        marks INTEGER NOT NULL
+    )
+    """)
+
+    # Idempotency keys of scan submissions, each stored in the transaction
+    # that marked it, with the answer a retry of that key gets
+    c.execute(f"""
+    CREATE TABLE IF NOT EXISTS scan_requests(
+        request_key TEXT PRIMARY KEY,
+        is_new {'SMALLINT' if USE_POSTGRES else 'INTEGER'} NOT NULL DEFAULT 0,
+        created_at {'BIGINT' if USE_POSTGRES else 'INTEGER'} NOT NULL
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS scan_requests_created ON scan_requests (created_at)")
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version(
+        version INTEGER PRIMARY KEY,
+        applied_at TEXT NOT NULL
+    )
+    """)
+    attendance_db.execute(c, "DELETE FROM schema_version WHERE version = ?", (SCHEMA_VERSION,))
+    attendance_db.execute(c, "INSERT INTO schema_version VALUES (?, ?)",
+                          (SCHEMA_VERSION, datetime.datetime.now().isoformat(timespec="seconds")))
+
     conn.commit()
+    attendance_db.load_schema(c)
     conn.close()
 
-# Initialize database only if not in production or on first run
+@app.cli.command("migrate")
+def migrate_command():
+    """Bring the database schema up to date (run once per deploy)."""
+    before = migrate()
+    if before < SCHEMA_VERSION:
+        click.echo(f"schema migrated from version {before} to {SCHEMA_VERSION}")
+    else:
+        click.echo(f"schema already at version {before}")
+
+# ---------- WRITE-BEHIND INGESTION ----------
+_ingest_queue = None
+
+def get_ingest_queue():
+    global _ingest_queue
+    if _ingest_queue is None:
+        _ingest_queue = WriteBehindQueue(db_writer, attendance_db.mark_requests,
+                                         max_batch=SCAN_BATCH_MAX_SIZE,
+                                         max_delay=SCAN_BATCH_MAX_DELAY_MS / 1000.0, log=log)
+    return _ingest_queue
+
+# Bring an older database up to date at startup; once migrated this is a
+# single version query
 try:
-    log(f"INIT: Starting init_db, USE_POSTGRES={USE_POSTGRES}, DATABASE_URL={'SET' if os.environ.get('DATABASE_URL') else 'NOT SET'}")
-    init_db()
-    log("INIT: init_db completed successfully")
+    if AUTO_MIGRATE:
+        migrate()
 except Exception as e:
     log(f"INIT ERROR: {e}")
     import traceback
@@ -187,7 +708,10 @@ def admin():
     if "admin" not in session:
         return redirect("/")
     added = request.args.get('added') or ''
-    return render_template("admin.html", added=added)
+    bulk = None
+    if 'imported' in request.args:
+        bulk = {k: request.args.get(k, 0, type=int) for k in ("imported", "duplicates", "invalid", "students")}
+    return render_template("admin.html", added=added, bulk=bulk)
 
 # ---------- STUDENT DASHBOARD ----------
 @app.route("/student", methods=["GET", "POST"])
@@ -195,9 +719,10 @@ def student():
     if session.get("role") != "student":
         return redirect("/student_login")
     if request.method == "POST":
+        # Roll number or full name; student_view resolves it through the roster
         name = request.form.get("name", "").strip()
         if name:
-            return redirect(f"/view?name={urllib.parse.quote_plus(name)}")
+            return redirect(f"/student_view?name={urllib.parse.quote_plus(name)}")
     return render_template("student.html")
 
 @app.route("/logout")
@@ -218,158 +743,632 @@ def debug_env():
     <p>SUPABASE_URL: {os.environ.get('SUPABASE_URL', 'NOT SET')}</p>
     """
 
-# ---------- GENERATE QR ----------
-@app.route("/generate")
-def generate():
+# ---------- METRICS ENDPOINT ----------
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+    # Streamed responses (exports) are timed to their first byte
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    queries, db_seconds = g.get("db_queries", 0), g.get("db_seconds", 0.0)
+    REQUEST_SECONDS.observe(elapsed, route, request.method, str(response.status_code))
+    REQUEST_QUERIES.observe(queries, route)
+    REQUEST_DB_SECONDS.observe(db_seconds, route)
+    response.headers["Server-Timing"] = f'db;dur={db_seconds * 1000:.1f};desc="{queries} queries", app;dur={elapsed * 1000:.1f}'
+    return response
+
+def _stats_of(get):
+    return lambda: get().stats() if get() is not None else {}
+
+metrics.gauges("db_pool", "Connection pool", _stats_of(lambda: _pool))
+metrics.gauges("qr_cache", "Rendered QR cache", _stats_of(lambda: qr_cache))
+metrics.gauges("view_cache", "Rendered page cache", _stats_of(lambda: response_cache))
+metrics.gauges("scan_ingest", "Write-behind scan queue", _stats_of(lambda: _ingest_queue))
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus text format; for an admin session, or a scraper sending METRICS_TOKEN"""
+    bearer = request.headers.get("Authorization", "")
+    if "admin" not in session and not (METRICS_TOKEN and hmac.compare_digest(bearer, f"Bearer {METRICS_TOKEN}")):
+        return "Forbidden", 403
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# Connection pool stats for sizing DB_POOL_SIZE
+@app.route("/pool-stats")
+def pool_stats():
     if "admin" not in session:
         return redirect("/")
-    subject = request.args.get('sub','')
-    branch = request.args.get('branch','')
-    expiry_dt = datetime.datetime.now() + datetime.timedelta(minutes=2)
-    expiry = expiry_dt.strftime("%H:%M")
-    expiry_ts = int(expiry_dt.timestamp())
-    url = f"{request.host_url}scan?exp={expiry}"
-    if subject:
-        url += f"&sub={urllib.parse.quote_plus(subject)}"
-    if branch:
-        url += f"&branch={urllib.parse.quote_plus(branch)}"
+    return jsonify(dict(get_pool().stats(), view_cache=response_cache.stats()))
+
+# ---------- GENERATE QR ----------
+QR_IMAGE_FORMAT = os.environ.get("QR_IMAGE_FORMAT", "png")
+QR_BOX_SIZE = 10
+QR_ERROR_CORRECTION = "M"
+QR_TTL_SECONDS = 120
+QR_TOKEN_SECRET = app.secret_key.encode()
+# Rotating-session tokens use a derived key so they can never be used to scan
+QR_STREAM_SECRET = hmac.new(QR_TOKEN_SECRET, b"qr-stream", hashlib.sha256).digest()
+# GET /scan swaps the QR's token (which may rotate within seconds) for a
+# form token bound to the same QR session, so the student has
+# SCAN_FORM_TTL seconds to fill in and submit the form. A derived key keeps
+# form tokens from working as QR links.
+QR_FORM_SECRET = hmac.new(QR_TOKEN_SECRET, b"scan-form", hashlib.sha256).digest()
+SCAN_FORM_TTL = int(os.environ.get("SCAN_FORM_TTL", "300"))
+QR_ROTATE_SECONDS = int(os.environ.get("QR_ROTATE_SECONDS", "0"))
+QR_ROTATE_MIN = 5
+QR_ROTATE_MAX = 60
+
+qr_cache = QRCache(max_entries=int(os.environ.get("QR_CACHE_SIZE", "256")),
+                   observe=lambda fmt, seconds: QR_RENDER_SECONDS.observe(seconds, fmt))
+
+def _qr_signature(url, exp, fmt, size, ec):
+    """HMAC so /qr only renders images that generate() handed out"""
+    msg = f"{url}|{exp}|{fmt}|{size}|{ec}".encode()
+    return hmac.new(app.secret_key.encode(), msg, hashlib.sha256).hexdigest()[:32]
+
+class RequestRejected(Exception):
+    """A request answered with a plain message instead of a page.
+
+    Raised by the validation helpers below, which both this app and the
+    async entry point (asgi_app.py) use, so the two serve the same answers.
+    """
+    def __init__(self, message, status=200, outcome="rejected"):
+        super().__init__(message)
+        self.message = message
+        self.outcome = outcome  # scan_outcomes_total label when rejecting a scan
+        self.status = status
+
+def parse_generate_args(args):
+    """(subject, branch, fmt, rotate) from /generate query arguments"""
+    subject = args.get('sub','')
+    branch = args.get('branch','')
+    fmt = args.get('fmt') or QR_IMAGE_FORMAT
+    if fmt not in MIMETYPES:
+        fmt = "png"
+    try:
+        rotate = int(args.get('rotate') or QR_ROTATE_SECONDS)
+    except ValueError:
+        rotate = 0
+    rotate = min(max(rotate, QR_ROTATE_MIN), QR_ROTATE_MAX) if rotate > 0 else 0
+    return subject, branch, fmt, rotate
+
+def generate_context(subject, branch, fmt, rotate, host_url):
+    """Template variables for admin.html showing a fresh QR"""
+    stream_token = None
+    if rotate:
+        # Rotating mode: the page holds a session token for /qr/stream and the
+        # QR itself shows the token for the current time step
+        stream_token = issue_token(QR_STREAM_SECRET, subject, branch, QR_TTL_SECONDS)
+        qr_session = verify_token(QR_STREAM_SECRET, stream_token)
+        token, _, next_at = step_token(QR_TOKEN_SECRET, qr_session, rotate)
+        token_exp = min(next_at + rotate, qr_session["exp"])
+        expiry_ts = qr_session["exp"]
+    else:
+        token = issue_token(QR_TOKEN_SECRET, subject, branch, QR_TTL_SECONDS)
+        expiry_ts = token_exp = verify_token(QR_TOKEN_SECRET, token)["exp"]
+    expiry = datetime.datetime.fromtimestamp(expiry_ts).strftime("%H:%M")
+    url = f"{host_url}scan?t={token}"
 
     qr_ok = False
     qr_error = None
-    qr_base64 = None
+    qr_src = None
     try:
-        img = qrcode.make(url)
-        # Save to bytes buffer instead of file (for Vercel compatibility)
-        img_buffer = io.BytesIO()
-        img.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        qr_base64 = base64.b64encode(img_buffer.getvalue()).decode()
+        qr_src = _qr_image_src(url, token_exp, fmt)
         qr_ok = True
     except Exception as e:
         qr_error = str(e)
         qr_ok = False
 
-    return render_template("admin.html", qr=qr_ok, expiry=expiry, subject=subject, branch=branch, expiry_ts=expiry_ts, qr_error=qr_error, qr_base64=qr_base64)
+    return dict(qr=qr_ok, expiry=expiry, subject=subject, branch=branch, expiry_ts=expiry_ts, qr_error=qr_error, qr_src=qr_src,
+                rotate=rotate, stream_token=stream_token, fmt=fmt)
+
+@app.route("/generate")
+def generate():
+    if "admin" not in session:
+        return redirect("/")
+    subject, branch, fmt, rotate = parse_generate_args(request.args)
+    return render_template("admin.html", **generate_context(subject, branch, fmt, rotate, request.host_url))
+
+def _qr_image_src(url, exp, fmt):
+    """Signed /qr.<fmt> URL for url, rendering it into the cache up front"""
+    # Warm the cache so the image request is served without rendering
+    qr_cache.get_or_render(url, fmt, QR_BOX_SIZE, QR_ERROR_CORRECTION, expires_at=exp)
+    query = urllib.parse.urlencode({"u": url, "exp": exp, "size": QR_BOX_SIZE, "ec": QR_ERROR_CORRECTION,
+                                    "sig": _qr_signature(url, exp, fmt, QR_BOX_SIZE, QR_ERROR_CORRECTION)})
+    return f"/qr.{fmt}?{query}"
+
+def rotating_qr_state(stream_token, rotate, fmt, host_url):
+    """Current QR of a rotating session; raises InvalidToken/TokenExpired"""
+    qr_session = verify_token(QR_STREAM_SECRET, stream_token)
+    rotate = min(max(rotate, QR_ROTATE_MIN), QR_ROTATE_MAX)
+    now = datetime.datetime.now().timestamp()
+    token, step, next_at = step_token(QR_TOKEN_SECRET, qr_session, rotate, now=now)
+    token_exp = min(next_at + rotate, qr_session["exp"])
+    url = f"{host_url}scan?t={token}"
+    return {
+        "step": step,
+        "src": _qr_image_src(url, token_exp, fmt if fmt in MIMETYPES else "png"),
+        "next_in_ms": int(max(0, min(next_at, qr_session["exp"]) - now) * 1000) + 50,
+        "expires": qr_session["exp"],
+    }
+
+def _request_qr_state():
+    return rotating_qr_state(request.args.get("s", ""), request.args.get("rotate", 0, type=int),
+                             request.args.get("fmt", "png"), request.host_url)
+
+@app.route("/qr/stream")
+def qr_stream():
+    """Server-Sent Events feed of a rotating QR session.
+
+    Each response carries one event and then ends, with a retry hint timed
+    to the next rotation; EventSource reconnects at that moment. No worker
+    thread is held between rotations, so many projector screens can follow
+    a session at once.
+    """
+    if "admin" not in session:
+        return redirect("/")
+    try:
+        state = _request_qr_state()
+    except TokenExpired:
+        body = "event: expired\ndata: {}\n\n"
+    except InvalidToken:
+        return "Invalid QR session", 403
+    else:
+        body = f"id: {state['step']}\nretry: {state['next_in_ms']}\ndata: {json.dumps(state)}\n\n"
+    response = Response(body, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route("/qr/current")
+def qr_current():
+    """Long-poll fallback for /qr/stream: JSON state plus when to ask again"""
+    if "admin" not in session:
+        return redirect("/")
+    try:
+        state = _request_qr_state()
+    except TokenExpired:
+        state = {"expired": True}
+    except InvalidToken:
+        return jsonify({"error": "invalid QR session"}), 403
+    response = jsonify(state)
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+def load_qr_image(fmt, args):
+    """Validate a signed /qr.<fmt> request; returns (image bytes, seconds left)"""
+    url = args.get("u", "")
+    ec = args.get("ec", QR_ERROR_CORRECTION)
+    try:
+        exp = int(args.get("exp", ""))
+        size = int(args.get("size", QR_BOX_SIZE))
+    except ValueError:
+        raise RequestRejected("Bad QR request", 400)
+    if fmt not in MIMETYPES or ec not in ERROR_LEVELS or not 1 <= size <= 40:
+        raise RequestRejected("Bad QR request", 400)
+    if not hmac.compare_digest(args.get("sig", ""), _qr_signature(url, exp, fmt, size, ec)):
+        raise RequestRejected("Bad QR signature", 403)
+    remaining = exp - int(datetime.datetime.now().timestamp())
+    if remaining <= 0:
+        raise RequestRejected("QR Expired", 410)
+    return qr_cache.get_or_render(url, fmt, size, ec, expires_at=exp), remaining
+
+@app.route("/qr.<fmt>")
+def qr_image(fmt):
+    if "admin" not in session:
+        return redirect("/")
+    try:
+        data, remaining = load_qr_image(fmt, request.args)
+    except RequestRejected as e:
+        return e.message, e.status
+    response = Response(data, mimetype=MIMETYPES[fmt])
+    response.set_etag(hashlib.sha256(data).hexdigest()[:32])
+    response.cache_control.private = True
+    response.cache_control.max_age = remaining
+    return response.make_conditional(request)
 
 # ---------- SCAN & MARK ----------
-@app.route("/scan", methods=["GET", "POST"])
-def scan():
-    exp = request.args.get("exp")
-    subj = request.args.get("sub") or None
-    branch = request.args.get("branch") or None
+ALREADY_MARKED_TODAY = "Attendance Already Marked for this Subject/Branch Today ⚠️"
+ALREADY_MARKED = "Attendance Already Marked ⚠️"
+TOO_MANY_SCANS = "Too many attempts, please wait a minute and try again ⏳"
+
+# Checked before any database work (see scan_guard): attempts per roll in a
+# QR session and per device per SCAN_RATE_WINDOW seconds, and the
+# rolls/devices already marked in a class, remembered for SCAN_RECENT_TTL
+# seconds. SCAN_GUARD_SHARED_PATH shares both between worker processes on
+# one host. Rolls and device ids come from the client, so each address also
+# has a much looser backstop: a whole class behind one campus NAT stays well
+# under SCAN_ADDRESS_RATE_LIMIT, a client inventing rolls or devices does not.
+SCAN_RATE_LIMIT = int(os.environ.get("SCAN_RATE_LIMIT", "10"))
+SCAN_ADDRESS_RATE_LIMIT = int(os.environ.get("SCAN_ADDRESS_RATE_LIMIT", "1500"))
+SCAN_RATE_WINDOW = int(os.environ.get("SCAN_RATE_WINDOW", "60"))
+SCAN_RECENT_TTL = int(os.environ.get("SCAN_RECENT_TTL", "600"))
+SCAN_GUARD_SIZE = int(os.environ.get("SCAN_GUARD_SIZE", "50000"))
+SCAN_GUARD_SHARED_PATH = os.environ.get("SCAN_GUARD_SHARED_PATH")
+SCAN_DEVICE_DEDUP = os.environ.get("SCAN_DEVICE_DEDUP", "1").lower() in ("1", "true", "yes")
+scan_guard = ScanGuard(limit=SCAN_RATE_LIMIT, window=SCAN_RATE_WINDOW, ttl=SCAN_RECENT_TTL,
+                       store=SQLiteGuardStore(SCAN_GUARD_SHARED_PATH) if SCAN_GUARD_SHARED_PATH
+                       else MemoryGuardStore(SCAN_GUARD_SIZE))
+metrics.gauges("scan_guard", "Scan rate limiter and recently-marked set", scan_guard.stats)
+
+def scan_device(remote_addr, headers, form):
+    """(fingerprint or None, device key or None) for the phone sending a scan.
+
+    The scan page posts a per-browser id plus screen and locale traits as
+    `device`. Without it (an old page or no JavaScript) phones of one model
+    behind one address look alike, so they get neither a device rate limit
+    nor deduplication against each other.
+    """
+    client = form.get("device", "")[:200]
+    if not client:
+        return None, None
+    fingerprint = hashlib.sha256("\x1f".join(
+        (remote_addr or "", headers.get("User-Agent", ""), headers.get("Accept-Language", ""), client)
+    ).encode()).hexdigest()[:32]
+    return fingerprint, fingerprint if SCAN_DEVICE_DEDUP else None
+
+def _marked_keys(row, device):
+    roll, date, subj, branch = row[0], row[2], row[4] or '', row[5] or ''
+    keys = {"roll": f"roll\x1f{date}\x1f{subj}\x1f{branch}\x1f{roll}"}
+    if device:
+        keys["device"] = f"device\x1f{date}\x1f{subj}\x1f{branch}\x1f{device}"
+    return keys
+
+def check_scan_rate(remote_addr, sid, form, fingerprint):
+    """RequestRejected once the scan's address, roll in the QR session or device is over its limit"""
+    limits = [(f"addr\x1f{remote_addr or ''}", SCAN_ADDRESS_RATE_LIMIT),
+              (f"roll\x1f{sid}\x1f{form.get('roll', '').strip()[:64]}", SCAN_RATE_LIMIT)]
+    if fingerprint:
+        limits.append((f"device\x1f{fingerprint}", SCAN_RATE_LIMIT))
+    for key, limit in limits:
+        if not scan_guard.allow(key, limit):
+            raise RequestRejected(TOO_MANY_SCANS, 429, outcome="rate_limited")
+
+def check_recently_marked(row, device):
+    """RequestRejected if this roll or device is known to have marked this class already"""
+    keys = _marked_keys(row, device)
+    if scan_guard.marked(keys["roll"]):
+        raise RequestRejected(ALREADY_MARKED, outcome="duplicate")
+    if "device" in keys and scan_guard.marked(keys["device"]):
+        raise RequestRejected(ALREADY_MARKED_TODAY, outcome="duplicate")
+
+def remember_scan(row, device, key=None):
+    """Record a committed (or duplicate) scan so repeats skip the database.
+
+    key is the idempotency key of a scan that was new, so its retries are
+    answered "marked" rather than "already marked".
+    """
+    keys = list(_marked_keys(row, device).values())
+    if key:
+        keys.append(f"request\x1f{key}")
+    scan_guard.mark(keys, row[4], row[5])
+
+# Scan submissions may carry a client-generated idempotency key (the
+# idempotency_key field or an Idempotency-Key header). It is stored in the
+# transaction that marks (AttendanceRepository.mark_requests), so a retry
+# after a lost response gets the first answer, and the mark's bookkeeping
+# isn't repeated. A key is stored with the QR session it was sent for, so
+# one reused for another class marks instead of replaying the first answer.
+# Keys are forgotten after SCAN_REQUEST_TTL seconds.
+IDEMPOTENCY_KEY = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+SCAN_REQUEST_TTL = int(os.environ.get("SCAN_REQUEST_TTL", str(2 * 24 * 3600)))
+SCAN_BATCH_LIMIT = 20  # marks per /scan/batch request
+SCAN_MESSAGES = {"new": "Attendance Marked ✅", "replayed": "Attendance Marked ✅", "duplicate": ALREADY_MARKED}
+
+def check_request_key(key, sid):
+    """The idempotency key of a scan in QR session sid, None if not sent, or RequestRejected"""
+    if not key:
+        return None
+    if not isinstance(key, str) or not IDEMPOTENCY_KEY.match(key):
+        raise RequestRejected("Invalid idempotency key ❌", 400)
+    return f"{sid}:{key}"
+
+def replayed_scan(key):
+    """True if key is remembered as a scan that was newly marked"""
+    return bool(key) and scan_guard.marked(f"request\x1f{key}")
+
+def scan_outcome(is_new, replayed):
+    return "new" if is_new and not replayed else "replayed" if is_new else "duplicate"
+
+def parse_scan_batch(payload):
+    """Marks of a /scan/batch body: {"marks": [{"t", "idempotency_key", "roll", ...}, ...]}"""
+    marks = payload.get("marks") if isinstance(payload, dict) else None
+    if not isinstance(marks, list) or not 0 < len(marks) <= SCAN_BATCH_LIMIT:
+        raise RequestRejected(f"Send 1 to {SCAN_BATCH_LIMIT} marks ❌", 400)
+    if not all(isinstance(m, dict) and m.get("idempotency_key") for m in marks):
+        raise RequestRejected("Every mark needs an idempotency_key ❌", 400)
+    # Form-like string values, as scan_row() expects
+    return [{k: str(v) for k, v in m.items() if v is not None} for m in marks]
+
+def scan_result(mark, outcome, message=None, status=200):
+    """One entry of a /scan/batch answer"""
+    return {"idempotency_key": mark.get("idempotency_key"), "outcome": outcome, "status": status,
+            "message": message or SCAN_MESSAGES[outcome]}
+
+def scan_token(token, form=False):
+    """Payload of a signed QR token, or RequestRejected.
+
+    With form=True a form token from GET /scan is accepted too (and a QR
+    token posted directly, as older scan pages do). Forged or expired links
+    are rejected without a session lookup or database connection.
+    """
+    for secret in (QR_FORM_SECRET, QR_TOKEN_SECRET) if form else (QR_TOKEN_SECRET,):
+        try:
+            return verify_token(secret, token)
+        except TokenExpired:
+            raise RequestRejected("QR Expired ❌", outcome="expired")
+        except InvalidToken:
+            continue
+    raise RequestRejected("Invalid QR Code ❌", 403, outcome="invalid")
+
+def check_scan_token(token):
+    """(subject, branch) of a signed QR token, or RequestRejected"""
+    qr = scan_token(token)
+    return qr["sub"] or None, qr["br"] or None
+
+def scan_form_token(token):
+    """Form token for the scan page opened with QR token `token`"""
+    qr = verify_token(QR_TOKEN_SECRET, token)
+    return issue_token(QR_FORM_SECRET, qr["sub"], qr["br"], SCAN_FORM_TTL, session_id=qr["sid"])
+
+def scan_session_key(subj, branch):
+    """Session flag that stops one device marking the same class twice today"""
     date = datetime.date.today().isoformat()
-    now = datetime.datetime.now().strftime("%H:%M")
+    return f"marked_{date}_{subj if subj else 'general'}_{branch if branch else 'general'}"
+
+def scan_row(form, subj, branch):
+    """(roll, name, date, time, subject, branch) for a scan form submission"""
+    roll = form.get("roll", "").strip()
+    name = form.get("name", "").strip()
+    if not roll or not name:
+        raise RequestRejected("Roll number and name are required ❌")
+    # Use client's local time and date if provided, otherwise use server time.
+    # A local date more than a day from the server's is not the phone's timezone.
+    today = datetime.date.today()
+    date = parse_date(form.get("local_date")) if form.get("local_date") else today.isoformat()
+    time = parse_time(form.get("local_time")) if form.get("local_time") else datetime.datetime.now().strftime("%H:%M:%S")
+    if not date or not time or abs((datetime.date.fromisoformat(date) - today).days) > SCAN_CLOCK_SKEW_DAYS:
+        raise RequestRejected("Invalid date or time ❌", 400)
+    return (roll, name, date, time, subj, branch)
 
-    if exp and now > exp:
-        return "QR Expired ❌"
+def submit_scan(token, form, key=None):
+    """Validate and store one scan submission from the current device.
 
-    # Check session to prevent multiple attempts from same device for this subject/branch today
-    session_key = f"marked_{date}_{subj if subj else 'general'}_{branch if branch else 'general'}"
-    if session.get(session_key):
-        return "Attendance Already Marked for this Subject/Branch Today ⚠️"
+    Returns the counted outcome: "new", "duplicate", or "replayed" for a
+    retry of a key that was newly marked. Raises RequestRejected for scans
+    refused before the database, and re-raises database errors.
+    """
+    try:
+        qr = scan_token(token, form=True)
+        subj, branch = qr["sub"] or None, qr["br"] or None
+        key = check_request_key(key, qr["sid"])
+        fingerprint, device = scan_device(request.remote_addr, request.headers, form)
+        check_scan_rate(request.remote_addr, qr["sid"], form, fingerprint)
+        if replayed_scan(key):
+            SCAN_OUTCOMES.inc("replayed")
+            return "replayed"
+        # Check session to prevent multiple attempts from same device for this subject/branch today
+        session_key = scan_session_key(subj, branch)
+        if session.get(session_key):
+            raise RequestRejected(ALREADY_MARKED_TODAY, outcome="duplicate")
+        row = scan_row(form, subj, branch)
+        check_recently_marked(row, device)
+    except RequestRejected as e:
+        SCAN_OUTCOMES.inc(e.outcome)
+        raise
 
+    try:
+        if SCAN_WRITE_BEHIND:
+            # The background writer commits this row with others from the
+            # same burst; mark() returns once that batch is committed
+            is_new, replayed = get_ingest_queue().mark(row, timeout=SCAN_BATCH_TIMEOUT, key=key)
+        else:
+            with db_writer() as c:
+                is_new, replayed = attendance_db.mark_requests(c, [(key, row)])[0]
+    except Exception as e:
+        SCAN_OUTCOMES.inc("error")
+        log(f"SCAN ERROR: {e}")
+        raise
+    remember_scan(row, device, key if is_new else None)
+    if key:
+        schedule_request_expiry()
+
+    outcome = scan_outcome(is_new, replayed)
+    if outcome == "new":
+        roll, name, date = row[:3]
+        attendance_marked(subj, branch, date, roll, name)
+    SCAN_OUTCOMES.inc(outcome)
+    session[session_key] = True
+    session.permanent = True
+    return outcome
+
+@app.route("/scan", methods=["GET", "POST"])
+def scan():
+    token = request.args.get("t", "")
     if request.method == "POST":
+        key = request.form.get("idempotency_key") or request.headers.get("Idempotency-Key")
         try:
-            roll = request.form.get("roll", "").strip()
-            name = request.form.get("name", "").strip()
-            
-            if not roll or not name:
-                return "Roll number and name are required ❌"
-            
-            subj = request.args.get("sub") or request.form.get("subject") or None
-            branch = request.args.get("branch") or request.form.get("branch") or None
-            
-            # Use client's local time and date if provided, otherwise use server time
-            time = request.form.get("local_time") or datetime.datetime.now().strftime("%H:%M:%S")
-            date = request.form.get("local_date") or datetime.date.today().isoformat()
-
-            log(f"SCAN POST: roll={roll}, name={name}, subj={subj}, branch={branch}, date={date}, time={time}, USE_POSTGRES={USE_POSTGRES}")
-            conn = get_db_connection()
-            c = conn.cursor()
-
-            # Check for duplicate: based on available columns
-            cols = []
-            if USE_POSTGRES:
-                # PostgreSQL - check columns differently
-                c.execute("SELECT column_name FROM information_schema.columns WHERE table_name='attendance'")
-                cols = [r[0] for r in c.fetchall()]
-            else:
-                # SQLite - use PRAGMA
-                c.execute("PRAGMA table_info(attendance)")
-                cols = [r[1] for r in c.fetchall()]
-            
-            # Check for duplicate attendance
-            if subj and branch and 'subject' in cols and 'branch' in cols:
-                if USE_POSTGRES:
-                    c.execute("SELECT * FROM attendance WHERE roll=%s AND date=%s AND subject=%s AND branch=%s", (roll, date, subj, branch))
-                else:
-                    c.execute("SELECT * FROM attendance WHERE roll=? AND date=? AND subject=? AND branch=?", (roll, date, subj, branch))
-            elif subj and 'subject' in cols:
-                if USE_POSTGRES:
-                    c.execute("SELECT * FROM attendance WHERE roll=%s AND date=%s AND subject=%s", (roll, date, subj))
-                else:
-                    c.execute("SELECT * FROM attendance WHERE roll=? AND date=? AND subject=?", (roll, date, subj))
-            elif branch and 'branch' in cols:
-                if USE_POSTGRES:
-                    c.execute("SELECT * FROM attendance WHERE roll=%s AND date=%s AND branch=%s", (roll, date, branch))
-                else:
-                    c.execute("SELECT * FROM attendance WHERE roll=? AND date=? AND branch=?", (roll, date, branch))
-            else:
-                if USE_POSTGRES:
-                    c.execute("SELECT * FROM attendance WHERE roll=%s AND date=%s", (roll, date))
-                else:
-                    c.execute("SELECT * FROM attendance WHERE roll=? AND date=?", (roll, date))
-            
-            if c.fetchone():
-                session[session_key] = True
-                session.permanent = True
-                conn.close()
-                return "Attendance Already Marked ⚠️"
-
-            # Insert including available columns
-            if 'subject' in cols and 'branch' in cols:
-                if USE_POSTGRES:
-                    c.execute("INSERT INTO attendance (roll, name, date, time, subject, branch) VALUES (%s,%s,%s,%s,%s,%s)",
-                              (roll, name, date, time, subj, branch))
-                else:
-                    c.execute("INSERT INTO attendance (roll, name, date, time, subject, branch) VALUES (?,?,?,?,?,?)",
-                              (roll, name, date, time, subj, branch))
-            elif 'subject' in cols:
-                if USE_POSTGRES:
-                    c.execute("INSERT INTO attendance (roll, name, date, time, subject) VALUES (%s,%s,%s,%s,%s)",
-                              (roll, name, date, time, subj))
-                else:
-                    c.execute("INSERT INTO attendance (roll, name, date, time, subject) VALUES (?,?,?,?,?)",
-                              (roll, name, date, time, subj))
-            elif 'branch' in cols:
-                if USE_POSTGRES:
-                    c.execute("INSERT INTO attendance (roll, name, date, time, branch) VALUES (%s,%s,%s,%s,%s)",
-                              (roll, name, date, time, branch))
-                else:
-                    c.execute("INSERT INTO attendance (roll, name, date, time, branch) VALUES (?,?,?,?,?)",
-                              (roll, name, date, time, branch))
-            else:
-                if USE_POSTGRES:
-                    c.execute("INSERT INTO attendance (roll, name, date, time) VALUES (%s,%s,%s,%s)",
-                              (roll, name, date, time))
-                else:
-                    c.execute("INSERT INTO attendance (roll, name, date, time) VALUES (?,?,?,?)",
-                              (roll, name, date, time))
-            conn.commit()
-            log("SCAN POST: insert committed successfully")
-            conn.close()
+            outcome = submit_scan(token, request.form, key)
+        except RequestRejected as e:
+            return e.message, e.status
+        except Exception as e:
+            # 500 so the scan page keeps the mark queued and retries it
+            return f"Error: {str(e)}", 500
+        return ALREADY_MARKED if outcome == "duplicate" else render_template("success.html")
+
+    try:
+        subj, branch = check_scan_token(token)
+    except RequestRejected as e:
+        SCAN_OUTCOMES.inc(e.outcome)
+        return e.message, e.status
+    if session.get(scan_session_key(subj, branch)):
+        SCAN_OUTCOMES.inc("duplicate")
+        return ALREADY_MARKED_TODAY
+    return render_template("scan.html", token=scan_form_token(token), subject=subj, branch=branch)
 
-            session[session_key] = True
-            session.permanent = True
+@app.route("/scan/batch", methods=["POST"])
+def scan_batch():
+    """Marks queued by a scan page while offline, flushed in one request.
 
-            return render_template("success.html")
+    Each mark is handled as a /scan POST of its own (with its own token and
+    idempotency key); the answer has one result per mark, in order.
+    """
+    try:
+        marks = parse_scan_batch(request.get_json(silent=True))
+    except RequestRejected as e:
+        return jsonify({"error": e.message}), e.status
+    results = []
+    for mark in marks:
+        try:
+            results.append(scan_result(mark, submit_scan(mark.get("t", ""), mark, mark["idempotency_key"])))
+        except RequestRejected as e:
+            results.append(scan_result(mark, e.outcome, e.message, e.status))
         except Exception as e:
-            print(f"Error in scan POST: {str(e)}")
-            return f"Error: {str(e)}"
+            results.append(scan_result(mark, "error", f"Error: {str(e)}", 500))
+    return jsonify({"results": results})
+
+# ---------- LIVE ATTENDANCE FEED ----------
+LIVE_REFRESH_MS = int(os.environ.get("LIVE_REFRESH_MS", "2000"))
+
+live_feed = LiveAttendance()
+
+def _live_seed(subject, branch, date):
+    """Stored mark count for a session, read once when the live feed first sees it"""
+    def seed():
+        conn = get_db_connection()
+        marks = attendance_db.session_marks(conn.cursor(), subject, branch, date)
+        conn.close()
+        return marks
+    return seed
+
+def attendance_marked(subject, branch, date, roll, name, seed=None):
+    """Bookkeeping after a new mark has been committed"""
+    invalidate_view_counts()
+    response_cache.changed(subject, branch)
+    live_feed.record(subject, branch, date, roll, name, seed=seed or _live_seed(subject, branch, date))
+
+def attendance_imported(scopes):
+    """Bookkeeping after a bulk insert into the given (subject, branch) scopes"""
+    invalidate_view_counts()
+    for subject, branch in scopes:
+        response_cache.changed(subject, branch)
+        # Re-seed these sessions from the database on next view
+        live_feed.forget(subject, branch)
+
+def attendance_removed(subject='', branch=''):
+    """Bookkeeping after rows were deleted ('' matches any subject/branch)"""
+    invalidate_view_counts()
+    if subject and branch:
+        response_cache.changed(subject, branch)
+    else:
+        response_cache.changed_all()
+    live_feed.forget(subject, branch)
+    # Deleted marks may be scanned again
+    scan_guard.forget(subject, branch)
+
+def _live_snapshot():
+    subject = request.args.get("sub") or ''
+    branch = request.args.get("branch") or ''
+    date = parse_date(request.args.get("date")) or datetime.date.today().isoformat()
+    return live_feed.snapshot(subject, branch, date, seed=_live_seed(subject, branch, date))
 
-    return render_template("scan.html")
+@app.route("/live/stream")
+def live_stream():
+    """SSE feed of the live count; one event per response, re-polled via retry"""
+    if "admin" not in session:
+        return redirect("/")
+    state = _live_snapshot()
+    body = f"id: {state['version']}\nretry: {LIVE_REFRESH_MS}\ndata: {json.dumps(state)}\n\n"
+    response = Response(body, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route("/live/counts")
+def live_counts():
+    if "admin" not in session:
+        return redirect("/")
+    response = jsonify(dict(_live_snapshot(), refresh_ms=LIVE_REFRESH_MS))
+    response.headers["Cache-Control"] = "no-store"
+    return response
 
 # ---------- VIEW ----------
+VIEW_PAGE_SIZE = int(os.environ.get("VIEW_PAGE_SIZE", "50"))
+VIEW_MAX_PAGE_SIZE = 500
+VIEW_COUNT_TTL = 30  # seconds a cached /view total stays valid
+
+# {filters: (expires_at, count)}
+_view_count_cache = {}
+
+# Rendered /view and /student_view pages, versioned by (subject, branch)
+# generation (see view_cache). VIEW_CACHE_SHARED_PATH shares the
+# generations between worker processes on one host; without it, workers
+# only see their own writes and VIEW_CACHE_TTL bounds how stale a page
+# from another worker can get.
+VIEW_CACHE_SIZE = int(os.environ.get("VIEW_CACHE_SIZE", "256"))
+VIEW_CACHE_TTL = int(os.environ.get("VIEW_CACHE_TTL", "60"))
+VIEW_CACHE_SHARED_PATH = os.environ.get("VIEW_CACHE_SHARED_PATH")
+response_cache = ResponseCache(max_entries=VIEW_CACHE_SIZE, ttl=VIEW_CACHE_TTL,
+                               generations=SQLiteGenerations(VIEW_CACHE_SHARED_PATH) if VIEW_CACHE_SHARED_PATH else None)
+
+def cached_page(key, version, render):
+    """Serve render() through response_cache, answering 304 if the client's copy is current"""
+    body, etag = response_cache.get_or_render(key, version, render)
+    response = Response(body, mimetype="text/html")
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def page_key(name, **extra):
+    """Cache key for a page: its name, the query string and anything else it depends on"""
+    return (name, tuple(sorted(request.args.items(multi=True))), tuple(sorted(extra.items())))
+
+def count_attendance(c, filters):
+    """Row count for a /view filter, cached briefly so paging doesn't recount"""
+    key = tuple(sorted(filters.items()))
+    now = datetime.datetime.now().timestamp()
+    cached = _view_count_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+    count = attendance_db.count(c, filters)
+    if len(_view_count_cache) > 1000:
+        _view_count_cache.clear()
+    _view_count_cache[key] = (now + VIEW_COUNT_TTL, count)
+    return count
+
+def invalidate_view_counts():
+    _view_count_cache.clear()
+
+def format_view_cursor(row):
+    # row is (roll, name, date, time, subject, branch, id); rows missing a
+    # date or time sort after the dated ones and page by id alone
+    if row[2] is None or row[3] is None:
+        return f"||{row[6]}"
+    return f"{row[2]}|{row[3]}|{row[6]}"
+
+def parse_view_cursor(value):
+    """Parse a 'date|time|id' (or '||id') page cursor; returns None if missing or malformed"""
+    if not value:
+        return None
+    parts = value.split("|")
+    if len(parts) != 3:
+        return None
+    if not parts[0] and not parts[1]:
+        date = time = None
+    else:
+        date, time = parse_date(parts[0]), parse_time(parts[1])
+        if not date or not time:
+            return None
+    try:
+        return (date, time, int(parts[2]))
+    except ValueError:
+        return None
+
 @app.route("/view")
 def view():
     # Allow both admin and student, but distinguish them
@@ -377,49 +1376,44 @@ def view():
         return redirect("/")
     
     is_admin = "admin" in session
-    
+    version = response_cache.version(request.args.get('sub') or '', request.args.get('branch') or '')
+    return cached_page(page_key("view", admin=is_admin), version, lambda: render_view(is_admin))
+
+def render_view(is_admin):
     selected_subject = request.args.get('sub') or ''
     selected_branch = request.args.get('branch') or ''
     selected_name = request.args.get('name') or ''
     selected_month = request.args.get('month') or ''
-    selected_day = request.args.get('day') or ''
+    selected_term = request.args.get('term') or ''
+    dates = date_filters(request.args)
 
     subjects = []
     branches = ["CAI", "CSM", "CSD", "CSE-A", "CSE-B", "CSE-C", "CSE-D", "MECH", "EEE", "ECE", "CIVIL"]
 
+    try:
+        per_page = min(max(int(request.args.get('per_page') or VIEW_PAGE_SIZE), 1), VIEW_MAX_PAGE_SIZE)
+    except ValueError:
+        per_page = VIEW_PAGE_SIZE
+    after = parse_view_cursor(request.args.get('after'))
+    before = parse_view_cursor(request.args.get('before')) if not after else None
+
+    filters = {"subject": selected_subject, "branch": selected_branch, "name": selected_name, **dates}
+    if selected_term:
+        filters["term"] = selected_term
     conn = get_db_connection()
     c = conn.cursor()
-    
-    # Dynamic query construction for filtering
-    query = "SELECT * FROM attendance WHERE 1=1"
-    params = []
-    if selected_subject:
-        if USE_POSTGRES:
-            query += " AND subject=%s"
-        else:
-            query += " AND subject=?"
-        params.append(selected_subject)
-    if selected_branch:
-        if USE_POSTGRES:
-            query += " AND branch=%s"
-        else:
-            query += " AND branch=?"
-        params.append(selected_branch)
-    if selected_name:
-        if USE_POSTGRES:
-            query += " AND name LIKE %s"
-        else:
-            query += " AND name LIKE ?"
-        params.append(f"%{selected_name}%")
-    
-    query += " ORDER BY date DESC, time DESC"
-    
-    c.execute(query, tuple(params) if params else ())
-    data = c.fetchall()
+    terms = [t[0] for t in attendance_db.archive_terms(c)]
+    data = attendance_db.page(c, filters, after=after, before=before, limit=per_page + 1)
+    total = count_attendance(c, filters)
     conn.close()
 
-    # Debug: print data count
-    print(f"View route: Found {len(data)} records")
+    has_more = len(data) > per_page
+    data = data[:per_page]
+    if before:
+        # Fetched oldest-first to walk backwards; show newest-first again
+        data.reverse()
+    next_cursor = format_view_cursor(data[-1]) if data and (has_more or before) else None
+    prev_cursor = format_view_cursor(data[0]) if data and (after or (before and has_more)) else None
 
     cleared = request.args.get('cleared')
     backup = request.args.get('backup')
@@ -429,43 +1423,64 @@ def view():
                            subjects=subjects, selected_subject=selected_subject, 
                            branches=branches, selected_branch=selected_branch, 
                            selected_name=selected_name, added=added, is_admin=is_admin,
-                           selected_month=selected_month, selected_day=selected_day)
+                           selected_month=selected_month, selected_from=request.args.get('date_from') or '',
+                           selected_to=request.args.get('date_to') or '',
+                           selected_term=selected_term, terms=terms, archive_all=ARCHIVE_ALL,
+                           archived=request.args.get('archived'),
+                           deleted=request.args.get('deleted'), undo=request.args.get('undo'),
+                           restored=request.args.get('restored'),
+                           total=total, per_page=per_page, next_cursor=next_cursor, prev_cursor=prev_cursor)
 
 # ---------- STUDENT VIEW ATTENDANCE ----------
 @app.route("/student_view")
 def student_view():
     if session.get("role") != "student":
         return redirect("/student_login")
-    student_name = request.args.get('name', '').strip()
+    roll = request.args.get('roll', '').strip()
+    query = request.args.get('name', '').strip()
     selected_subject = request.args.get('sub', '').strip()
-    if not student_name:
+    if not roll and not query:
         return redirect("/student")
+    # Percentages depend on sessions held in every subject, so any write counts
+    return cached_page(page_key("student_view"), response_cache.version(),
+                       lambda: render_student_view(roll, query, selected_subject))
 
+def render_student_view(roll, query, selected_subject):
     subjects = []
 
     conn = get_db_connection()
     c = conn.cursor()
-    # Fetch all records for the student to calculate correct stats regardless of filter
-    if USE_POSTGRES:
-        c.execute("SELECT * FROM attendance WHERE name=%s ORDER BY date DESC, time DESC", (student_name,))
-    else:
-        c.execute("SELECT * FROM attendance WHERE name=? ORDER BY date DESC, time DESC", (student_name,))
-    all_data = c.fetchall()
-    conn.close()
-
-    if selected_subject:
-        data = [row for row in all_data if len(row) > 4 and row[4] == selected_subject]
-    else:
-        data = all_data
+    students = attendance_db.find_students(c, roll=roll, name=query)
+    if not students:
+        conn.close()
+        return render_template("student_view.html", data=[], student_name=query or roll, student_roll='',
+                               student_query=query, subjects=[], selected_subject='', attendance_count={}, stats=[])
+    rolls = [s[0] for s in students]
+    student_name = ", ".join(sorted({s[1] for s in students}))
+    # A single match is carried by roll, so the subject filter keeps to it
+    student_roll = rolls[0] if len(rolls) == 1 else ''
+    data = attendance_db.student_rows(c, rolls, selected_subject)
 
-    # Calculate attendance count per subject
+    # Per-subject attendance against sessions actually held, read from the
+    # aggregate tables rather than counted from the rows above
+    stats = []
     attendance_count = {}
-    for row in all_data:
-        subj = row[4] if len(row) > 4 else ''
+    for subj, branch, attended, held in attendance_db.student_stats(c, rolls):
         if subj:
-            attendance_count[subj] = attendance_count.get(subj, 0) + 1
+            subjects.append(subj)
+            attendance_count[subj] = attendance_count.get(subj, 0) + attended
+        stats.append({
+            "subject": subj,
+            "branch": branch,
+            "attended": attended,
+            "held": held,
+            "percent": round(100.0 * attended / held, 1) if held else 0.0,
+        })
+    conn.close()
 
-    return render_template("student_view.html", data=data, student_name=student_name, subjects=subjects, selected_subject=selected_subject, attendance_count=attendance_count)
+    return render_template("student_view.html", data=data, student_name=student_name, student_roll=student_roll,
+                           student_query=query, subjects=sorted(set(subjects)),
+                           selected_subject=selected_subject, attendance_count=attendance_count, stats=stats)
 
 # ---------- MANUAL ADD ATTENDANCE ----------
 @app.route("/manual_add", methods=["POST"])
@@ -476,108 +1491,140 @@ def manual_add():
     name = (request.form.get("name") or "").strip()
     subj = request.form.get("subject") or None
     branch = request.form.get("branch") or None
-    date = request.form.get("date") or datetime.date.today().isoformat()
-    time = request.form.get("time") or datetime.datetime.now().strftime("%H:%M:%S")
+    date = parse_date(request.form.get("date")) if request.form.get("date") else datetime.date.today().isoformat()
+    time = parse_time(request.form.get("time")) if request.form.get("time") else datetime.datetime.now().strftime("%H:%M:%S")
 
-    if not roll or not name:
-        return redirect(f"/admin?added=error")
+    if not roll or not name or not date or not time:
+        return redirect("/admin?added=error")
 
-    conn = get_db_connection()
-    c = conn.cursor()
-    if USE_POSTGRES:
-        c.execute("SELECT column_name FROM information_schema.columns WHERE table_name='attendance'")
-        cols = [r[0] for r in c.fetchall()]
-    else:
-        c.execute("PRAGMA table_info(attendance)")
-        cols = [r[1] for r in c.fetchall()]
+    # A mark already made that day is skipped by the attendance_mark_key index
+    with db_writer() as c:
+        is_new = attendance_db.mark(c, roll, name, date, time, subj, branch)
+    if not is_new:
+        return redirect("/admin?added=exists")
+    attendance_marked(subj, branch, date, roll, name)
+    return redirect("/admin?added=1")
 
-    # Duplicate check similar to /scan
-    if subj and branch and 'subject' in cols and 'branch' in cols:
-        if USE_POSTGRES:
-            c.execute("SELECT * FROM attendance WHERE roll=%s AND date=%s AND subject=%s AND branch=%s", (roll, date, subj, branch))
-        else:
-            c.execute("SELECT * FROM attendance WHERE roll=? AND date=? AND subject=? AND branch=?", (roll, date, subj, branch))
-    elif subj and 'subject' in cols:
-        if USE_POSTGRES:
-            c.execute("SELECT * FROM attendance WHERE roll=%s AND date=%s AND subject=%s", (roll, date, subj))
-        else:
-            c.execute("SELECT * FROM attendance WHERE roll=? AND date=? AND subject=?", (roll, date, subj))
-    elif branch and 'branch' in cols:
-        if USE_POSTGRES:
-            c.execute("SELECT * FROM attendance WHERE roll=%s AND date=%s AND branch=%s", (roll, date, branch))
-        else:
-            c.execute("SELECT * FROM attendance WHERE roll=? AND date=? AND branch=?", (roll, date, branch))
-    else:
-        if USE_POSTGRES:
-            c.execute("SELECT * FROM attendance WHERE roll=%s AND date=%s", (roll, date))
-        else:
-            c.execute("SELECT * FROM attendance WHERE roll=? AND date=?", (roll, date))
-    if c.fetchone():
-        conn.close()
-        return redirect(f"/admin?added=exists")
+# ---------- BULK ADD ATTENDANCE ----------
+BULK_BATCH_SIZE = 1000
 
-    # Insert including available columns
-    if 'subject' in cols and 'branch' in cols:
-        if USE_POSTGRES:
-            c.execute("INSERT INTO attendance (roll, name, date, time, subject, branch) VALUES (%s,%s,%s,%s,%s,%s)",
-                      (roll, name, date, time, subj, branch))
-        else:
-            c.execute("INSERT INTO attendance (roll, name, date, time, subject, branch) VALUES (?,?,?,?,?,?)",
-                      (roll, name, date, time, subj, branch))
-    elif 'subject' in cols:
-        if USE_POSTGRES:
-            c.execute("INSERT INTO attendance (roll, name, date, time, subject) VALUES (%s,%s,%s,%s,%s)",
-                      (roll, name, date, time, subj))
-        else:
-            c.execute("INSERT INTO attendance (roll, name, date, time, subject) VALUES (?,?,?,?,?)",
-                      (roll, name, date, time, subj))
-    elif 'branch' in cols:
-        if USE_POSTGRES:
-            c.execute("INSERT INTO attendance (roll, name, date, time, branch) VALUES (%s,%s,%s,%s,%s)",
-                      (roll, name, date, time, branch))
-        else:
-            c.execute("INSERT INTO attendance (roll, name, date, time, branch) VALUES (?,?,?,?,?)",
-                      (roll, name, date, time, branch))
-    else:
-        if USE_POSTGRES:
-            c.execute("INSERT INTO attendance (roll, name, date, time) VALUES (%s,%s,%s,%s)",
-                      (roll, name, date, time))
-        else:
-            c.execute("INSERT INTO attendance (roll, name, date, time) VALUES (?,?,?,?)",
-                      (roll, name, date, time))
-    conn.commit()
-    conn.close()
-    return redirect(f"/admin?added=1")
+@app.route("/bulk_add", methods=["POST"])
+def bulk_add():
+    """Mark attendance for every row of an uploaded CSV.
+
+    The file is parsed as it is read, repeats inside the file are dropped
+    against an in-memory set, and the remaining rows are inserted
+    BULK_BATCH_SIZE at a time, one transaction per batch. Rows already in
+    the table are skipped by the insert itself (ON CONFLICT DO NOTHING).
+    With the "roster" box ticked only the students roster is loaded: names
+    and branches are saved (replacing earlier ones) and nobody is marked.
+    """
+    if "admin" not in session:
+        return redirect("/")
+    upload = request.files.get("file")
+    if not upload:
+        return redirect("/admin?added=error")
+    defaults = {
+        "subject": request.form.get("subject") or None,
+        "branch": request.form.get("branch") or None,
+        "date": request.form.get("date") or datetime.date.today().isoformat(),
+        "time": parse_time(request.form.get("time")) or datetime.datetime.now().strftime("%H:%M:%S"),
+    }
+
+    roster = bool(request.form.get("roster"))
+    report = {"imported": 0, "duplicates": 0, "invalid": 0}
+    if roster:
+        report["students"] = 0
+    seen = set()
+    scopes = set()
+    batch = []
+
+    def flush():
+        with db_writer() as c:
+            if roster:
+                attendance_db.save_students(c, [(r[0], r[1], r[5]) for r in batch])
+                report["students"] += len(batch)
+            else:
+                results = attendance_db.mark_many(c, batch)
+                report["imported"] += sum(results)
+                report["duplicates"] += len(results) - sum(results)
+        batch.clear()
+
+    text = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", errors="replace", newline="")
+    import importers
+    for row in importers.read_attendance_csv(text, defaults):
+        if row is None:
+            report["invalid"] += 1
+            continue
+        key = row[0] if roster else (row[0], row[2], row[4] or '', row[5] or '')
+        if key in seen:
+            report["duplicates"] += 1
+            continue
+        seen.add(key)
+        scopes.add((row[4] or '', row[5] or ''))
+        batch.append(row)
+        if len(batch) >= BULK_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+
+    log(f"BULK ADD: {report}")
+    if report["imported"]:
+        attendance_imported(scopes)
+    elif report.get("students"):
+        # Roster names show on every page
+        response_cache.changed_all()
+    if request.args.get("format") == "json":
+        return jsonify(report)
+    return redirect("/admin?" + urllib.parse.urlencode(report))
 
 # ---------- DELETE RECORD ----------
+# Deletes run DELETE_BATCH_SIZE rows per transaction, pausing DELETE_PAUSE_MS
+# between batches so scans waiting on the write lock get their turn. With
+# SOFT_DELETE the rows are tombstoned and can be restored for
+# UNDO_WINDOW_SECONDS; a background timer purges them after that.
+DELETE_BATCH_SIZE = int(os.environ.get("DELETE_BATCH_SIZE", "1000"))
+DELETE_PAUSE_MS = float(os.environ.get("DELETE_PAUSE_MS", "10"))
+SOFT_DELETE = os.environ.get("SOFT_DELETE", "1").lower() in ("1", "true", "yes")
+UNDO_WINDOW_SECONDS = int(os.environ.get("UNDO_WINDOW_SECONDS", "600"))
+
+def run_in_batches(step):
+    """Call step(c) in its own write transaction until it returns 0; returns the total"""
+    done = 0
+    while True:
+        with db_writer() as c:
+            n = step(c)
+        if not n:
+            return done
+        done += n
+        time.sleep(DELETE_PAUSE_MS / 1000)
+
+def delete_stamp():
+    """Stamp for one deletion: epoch microseconds, or None for a hard delete"""
+    return time.time_ns() // 1000 if SOFT_DELETE else None
+
+def undo_link(stamp):
+    return f"&undo={stamp}" if stamp else ""
+
 @app.route("/delete")
 def delete():
     if "admin" not in session:
         return redirect("/")
-    roll = request.args.get("roll")
-    date = request.args.get("date")
-    time = request.args.get("time")
-    subject = request.args.get("subject")
-    if not (roll and date and time):
+    row_id = request.args.get("id", type=int)
+    subject = request.args.get("sub") or ''
+    if not row_id:
         return redirect("/view")
-    conn = get_db_connection()
-    c = conn.cursor()
-    if subject:
-        if USE_POSTGRES:
-            c.execute("DELETE FROM attendance WHERE roll=%s AND date=%s AND time=%s AND subject=%s", (roll, date, time, subject))
-        else:
-            c.execute("DELETE FROM attendance WHERE roll=? AND date=? AND time=? AND subject=?", (roll, date, time, subject))
-    else:
-        if USE_POSTGRES:
-            c.execute("DELETE FROM attendance WHERE roll=%s AND date=%s AND time=%s", (roll, date, time))
-        else:
-            c.execute("DELETE FROM attendance WHERE roll=? AND date=? AND time=?", (roll, date, time))
-    conn.commit()
-    conn.close()
+    stamp = delete_stamp()
+    with db_writer() as c:
+        scopes = attendance_db.delete_ids(c, [row_id], stamp)
+    deleted = len(scopes)
+    for row_subject, row_branch in set(scopes):
+        attendance_removed(row_subject or '', row_branch or '')
+    if deleted:
+        schedule_purge()
     # preserve subject filter when redirecting
-    if subject:
-        return redirect(f"/view?sub={urllib.parse.quote_plus(subject)}")
-    return redirect("/view")
+    return redirect(f"/view?deleted={deleted}{undo_link(stamp if deleted else None)}"
+                    f"&sub={urllib.parse.quote_plus(subject)}")
 
 # ---------- CLEAR ALL ATTENDANCE ----------
 @app.route("/clear_all", methods=["POST"])
@@ -586,81 +1633,214 @@ def clear_all():
         return redirect("/")
     subject = request.form.get('subject') or ''
     branch = request.form.get('branch') or ''
-    conn = get_db_connection()
-    c = conn.cursor()
-    if subject and branch:
-        if USE_POSTGRES:
-            c.execute("DELETE FROM attendance WHERE subject=%s AND branch=%s", (subject, branch))
-        else:
-            c.execute("DELETE FROM attendance WHERE subject=? AND branch=?", (subject, branch))
-    elif subject:
-        if USE_POSTGRES:
-            c.execute("DELETE FROM attendance WHERE subject=%s", (subject,))
-        else:
-            c.execute("DELETE FROM attendance WHERE subject=?", (subject,))
-    elif branch:
-        if USE_POSTGRES:
-            c.execute("DELETE FROM attendance WHERE branch=%s", (branch,))
-        else:
-            c.execute("DELETE FROM attendance WHERE branch=?", (branch,))
+    stamp = delete_stamp()
+    deleted = run_in_batches(lambda c: attendance_db.delete_chunk(c, subject, branch, stamp, limit=DELETE_BATCH_SIZE))
+    log(f"CLEAR: deleted {deleted} rows (subject={subject!r}, branch={branch!r}, soft={stamp is not None})")
+    if deleted:
+        attendance_removed(subject, branch)
+        schedule_purge()
+    return redirect(f"/view?cleared={1 if deleted else 2}&deleted={deleted}{undo_link(stamp if deleted else None)}"
+                    f"&sub={urllib.parse.quote_plus(subject)}&branch={urllib.parse.quote_plus(branch)}")
+
+@app.route("/undo_delete", methods=["POST"])
+def undo_delete():
+    if "admin" not in session:
+        return redirect("/")
+    stamp = request.form.get("undo", type=int)
+    if not stamp or time.time_ns() // 1000 - stamp > UNDO_WINDOW_SECONDS * 1_000_000:
+        return "This deletion can no longer be undone ❌", 400
+    restored = run_in_batches(lambda c: attendance_db.restore_chunk(c, stamp, limit=DELETE_BATCH_SIZE))
+    log(f"UNDO: restored {restored} rows deleted at {stamp}")
+    if restored:
+        attendance_removed()
+    return redirect(f"/view?restored={restored}")
+
+# ---------- PURGE DELETED ----------
+_purge_timer = None
+_purge_lock = threading.Lock()
+
+def purge_deleted():
+    """Remove tombstoned rows older than the undo window; returns how many went"""
+    cutoff = time.time_ns() // 1000 - UNDO_WINDOW_SECONDS * 1_000_000
+    purged = run_in_batches(lambda c: attendance_db.purge_chunk(c, cutoff, limit=DELETE_BATCH_SIZE))
+    if purged:
+        log(f"PURGE: removed {purged} deleted rows")
+    return purged
+
+# ---------- IDEMPOTENCY KEY EXPIRY ----------
+SCAN_REQUEST_EXPIRY_INTERVAL = 3600  # seconds between sweeps while keyed scans arrive
+
+_expiry_timer = None
+
+def expire_scan_requests():
+    """Forget scan idempotency keys older than SCAN_REQUEST_TTL; returns how many went"""
+    with db_writer() as c:
+        expired = attendance_db.expire_requests(c, int(time.time()) - SCAN_REQUEST_TTL)
+    if expired:
+        log(f"PURGE: forgot {expired} scan idempotency keys")
+    return expired
+
+def _expire_requests():
+    global _expiry_timer
+    with _purge_lock:
+        _expiry_timer = None
+    try:
+        expire_scan_requests()
+    except Exception as e:
+        log(f"PURGE: expiring idempotency keys failed: {e}")
+
+def schedule_request_expiry():
+    """Arm a background sweep of old idempotency keys, unless one is pending"""
+    global _expiry_timer
+    with _purge_lock:
+        if _expiry_timer is not None:
+            return
+        _expiry_timer = threading.Timer(SCAN_REQUEST_EXPIRY_INTERVAL, _expire_requests)
+        _expiry_timer.daemon = True
+        _expiry_timer.start()
+
+def _purge_and_reschedule():
+    global _purge_timer
+    with _purge_lock:
+        _purge_timer = None
+    try:
+        purge_deleted()
+    except Exception as e:
+        log(f"PURGE: failed: {e}")
+    schedule_purge()
+
+def schedule_purge():
+    """Arm a background timer for when the oldest tombstone leaves the undo window"""
+    global _purge_timer
+    with _purge_lock:
+        if _purge_timer is not None:
+            return
+        conn = get_db_connection()
+        oldest = attendance_db.oldest_tombstone(conn.cursor())
+        conn.close()
+        if oldest is None:
+            return
+        delay = max(0.0, (oldest / 1_000_000 + UNDO_WINDOW_SECONDS) - time.time()) + 1
+        _purge_timer = threading.Timer(delay, _purge_and_reschedule)
+        _purge_timer.daemon = True
+        _purge_timer.start()
+
+@app.cli.command("purge-deleted")
+def purge_deleted_command():
+    """Permanently remove deleted attendance older than the undo window, and expired scan idempotency keys."""
+    click.echo(f"purged {purge_deleted()} rows")
+    click.echo(f"forgot {expire_scan_requests()} scan idempotency keys")
+
+# ---------- SEMESTER ARCHIVE ----------
+ARCHIVE_BATCH_SIZE = 1000
+
+def archive_term(term, before):
+    """Move attendance dated before `before` into the archive as `term`.
+
+    Rows move ARCHIVE_BATCH_SIZE at a time, one transaction per batch, so
+    scans keep committing in between. Returns the number of rows moved.
+    """
+    with db_writer() as c:
+        attendance_db.prepare_archive(c, term)
+    if USE_POSTGRES:
+        moved = run_in_batches(lambda c: attendance_db.archive_chunk(c, term, before, limit=ARCHIVE_BATCH_SIZE))
     else:
-        c.execute("DELETE FROM attendance")
-    conn.commit()
-    conn.close()
-    return redirect(f"/view?cleared=1&sub={urllib.parse.quote_plus(subject)}&branch={urllib.parse.quote_plus(branch)}")
+        # The archive is an attached file: commit each copy before deleting
+        # the originals (see AttendanceRepository.archive_copy)
+        moved = 0
+        while True:
+            with db_writer() as c:
+                ids = attendance_db.archive_copy(c, term, before, limit=ARCHIVE_BATCH_SIZE)
+            if not ids:
+                break
+            with db_writer() as c:
+                moved += attendance_db.archive_remove(c, term, before, ids)
+            time.sleep(DELETE_PAUSE_MS / 1000)
+    log(f"ARCHIVE: moved {moved} rows dated before {before} into term {term}")
+    if moved:
+        attendance_removed()
+    return moved
+
+@app.route("/archive", methods=["POST"])
+def archive():
+    if "admin" not in session:
+        return redirect("/")
+    term = (request.form.get("term") or "").strip().lower()
+    before = parse_date(request.form.get("before"))
+    if not ARCHIVE_TERM.match(term) or term == ARCHIVE_ALL or not before:
+        return "Archive needs a term name (letters, digits, '-') and a cutoff date ❌", 400
+    moved = archive_term(term, before)
+    if request.args.get("format") == "json":
+        return jsonify({"term": term, "before": before, "archived": moved})
+    return redirect(f"/view?archived={moved}&term={urllib.parse.quote_plus(term)}")
+
+@app.cli.command("archive")
+@click.argument("term")
+@click.argument("before")
+def archive_command(term, before):
+    """Archive attendance dated before BEFORE (YYYY-MM-DD) as TERM."""
+    term = term.strip().lower()
+    if not ARCHIVE_TERM.match(term) or term == ARCHIVE_ALL or not parse_date(before):
+        raise click.BadParameter("usage: flask --app app1 archive TERM YYYY-MM-DD")
+    click.echo(f"archived {archive_term(term, parse_date(before))} rows as {term}")
 
 # ---------- EXPORT CSV ----------
+EXPORT_FETCH_SIZE = 2000
+
+# format -> (file extension, mimetype)
+EXPORT_FORMATS = {
+    "csv": ("csv", "text/csv"),
+    "csv.gz": ("csv.gz", "application/gzip"),
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+def iter_attendance(filters):
+    """Stream export rows on a connection of its own, released when the stream ends"""
+    conn = get_pool().checkout()
+    try:
+        yield from attendance_db.iter_export(conn, filters, fetch_size=EXPORT_FETCH_SIZE)
+    finally:
+        conn.close()
+
 @app.route("/export")
 def export():
     if "admin" not in session:
         return redirect("/")
     selected_subject = request.args.get('sub') or ''
     selected_branch = request.args.get('branch') or ''
-    conn = get_db_connection()
-    c = conn.cursor()
-    if selected_subject and selected_branch:
-        if USE_POSTGRES:
-            c.execute("SELECT * FROM attendance WHERE subject=%s AND branch=%s ORDER BY date DESC, time DESC", (selected_subject, selected_branch))
-        else:
-            c.execute("SELECT * FROM attendance WHERE subject=? AND branch=? ORDER BY date DESC, time DESC", (selected_subject, selected_branch))
-    elif selected_subject:
-        if USE_POSTGRES:
-            c.execute("SELECT * FROM attendance WHERE subject=%s ORDER BY date DESC, time DESC", (selected_subject,))
-        else:
-            c.execute("SELECT * FROM attendance WHERE subject=? ORDER BY date DESC, time DESC", (selected_subject,))
-    elif selected_branch:
-        if USE_POSTGRES:
-            c.execute("SELECT * FROM attendance WHERE branch=%s ORDER BY date DESC, time DESC", (selected_branch,))
-        else:
-            c.execute("SELECT * FROM attendance WHERE branch=? ORDER BY date DESC, time DESC", (selected_branch,))
+    fmt = request.args.get('format') or 'csv'
+    if fmt not in EXPORT_FORMATS:
+        return f"Unsupported export format: {fmt} ❌", 400
+
+    header = ["Roll", "Name", "Date", "Time", "Subject", "Branch"]
+    filters = {"subject": selected_subject, "branch": selected_branch, **date_filters(request.args)}
+    if request.args.get('term'):
+        filters["term"] = request.args.get('term')
+    rows = iter_attendance(filters)
+    import exporters
+    if fmt == "xlsx":
+        body = exporters.xlsx_chunks(header, rows)
     else:
-        c.execute("SELECT * FROM attendance ORDER BY date DESC, time DESC")
-    data = c.fetchall()
-    conn.close()
+        body = exporters.csv_chunks(header, rows)
+        if fmt == "csv.gz":
+            body = exporters.gzip_chunks(body)
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    # Include headers based on available columns
-    header = ["Roll", "Name", "Date", "Time"]
-    if data and len(data[0]) > 4:
-        header.append("Subject")
-    if data and len(data[0]) > 5:
-        header.append("Branch")
-    writer.writerow(header)
-    writer.writerows(data)
-
-    filename = "attendance.csv"
+    ext, mimetype = EXPORT_FORMATS[fmt]
+    filename = f"attendance.{ext}"
     if selected_subject:
-        filename = f"attendance_{selected_subject}.csv"
+        filename = f"attendance_{selected_subject}.{ext}"
     if selected_branch:
-        filename = f"attendance_{selected_branch}.csv"
+        filename = f"attendance_{selected_branch}.{ext}"
 
-    return send_file(
-        io.BytesIO(output.getvalue().encode()),
-        mimetype="text/csv",
-        as_attachment=True,
-        download_name=filename
-    )
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    # Same Content-Disposition encoding send_file uses for non-ASCII names
+    try:
+        filename.encode("ascii")
+        response.headers.set("Content-Disposition", "attachment", filename=filename)
+    except UnicodeEncodeError:
+        response.headers.set("Content-Disposition", "attachment",
+                             **{"filename*": f"UTF-8''{urllib.parse.quote(filename)}"})
+    return response
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=False)
\ No newline at end of file
@@ -0,0 +1,379 @@
+"""Async (ASGI) entry point for the scan burst path.
+
+When a whole class scans at once, the WSGI app needs one thread per
+in-flight request, and every thread waits on the database. Here /scan,
+/generate and the live endpoints run on an event loop instead: database
+calls go through asyncpg (Postgres) or aiosqlite (SQLite), and /qr/stream
+and /live/stream hold their SSE connection open without tying up a
+thread. Validation, QR rendering and the SQL all come from app1, so both
+modes answer the same way. Every other route is handed to the Flask app
+through a WSGI adapter.
+
+Run with:  uvicorn asgi_app:app --workers 1
+Extra dependencies: requirements-async.txt
+"""
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import time
+
+import aiosqlite
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, Response, g, jsonify, redirect, render_template, request, session
+
+import app1
+from attendance_repo import STATEMENTS, numbered
+from qr_render import MIMETYPES
+from qr_tokens import InvalidToken, TokenExpired
+
+# Paths served by the async app; everything else goes to app1.app
+ASYNC_PATHS = ("/scan", "/generate", "/qr.", "/qr/", "/live/")
+
+# How often a held-open SSE stream checks the in-memory live feed, and how
+# long a stream stays open before the browser is asked to reconnect
+LIVE_PUSH_MS = 500
+STREAM_MAX_SECONDS = 300
+
+quart_app = Quart(__name__)
+quart_app.secret_key = app1.app.secret_key
+quart_app.permanent_session_lifetime = app1.app.permanent_session_lifetime
+
+_pg_pool = None
+_sqlite = None
+_sqlite_lock = asyncio.Lock()
+
+
+@quart_app.before_serving
+async def _open_database():
+    global _pg_pool, _sqlite
+    if not app1.attendance_db.schema_loaded:
+        # Load the schema cache before the first scan
+        conn = app1.get_db_connection()
+        app1.attendance_db.load_schema(conn.cursor())
+        conn.close()
+    if app1.USE_POSTGRES:
+        import asyncpg
+        app1.log("DB: async pool connecting to Postgres via DATABASE_URL")
+        # asyncpg caches prepared statements per connection, which a
+        # transaction-mode pooler cannot keep; follow DB_PREPARED_STATEMENTS
+        _pg_pool = await asyncpg.create_pool(os.environ.get("DATABASE_URL"), min_size=1,
+                                             max_size=app1.DB_POOL_SIZE, timeout=app1.DB_POOL_TIMEOUT,
+                                             statement_cache_size=100 if app1.DB_PREPARED_STATEMENTS else 0)
+    else:
+        app1.log(f"DB: async SQLite at {app1.sqlite_path()}")
+        _sqlite = await aiosqlite.connect(app1.sqlite_path(), timeout=app1.SQLITE_BUSY_TIMEOUT_MS / 1000.0)
+        for pragma in app1.SQLITE_PRAGMAS:
+            await _sqlite.execute(pragma)
+
+
+@quart_app.after_serving
+async def _close_database():
+    if _pg_pool is not None:
+        await _pg_pool.close()
+    if _sqlite is not None:
+        await _sqlite.close()
+
+
+async def mark_attendance(row, key=None):
+    """Async twin of AttendanceRepository.mark_requests for one request, in its own transaction.
+
+    Returns (is_new, replayed) like mark_requests.
+    """
+    roll, name, date, time_, subj, branch = row
+    if app1.USE_POSTGRES:
+        # asyncpg binds DATE/TIME parameters from date/time objects only
+        date, time_ = datetime.date.fromisoformat(date), datetime.time.fromisoformat(time_)
+    values = {"roll": roll, "name": name, "date": date, "time": time_, "subject": subj, "branch": branch}
+    sql, keys = app1.attendance_db.mark_statement()
+    params = [values[k] for k in keys]
+    student = (roll, name, branch)
+    stats = ((roll, subj or '', branch or '', 1), (subj or '', branch or '', date, 1))
+    claim = (key, int(time.time()))
+
+    if app1.USE_POSTGRES:
+        async with _pg_pool.acquire() as conn:
+            async with conn.transaction():
+                if key and (await conn.execute(numbered(STATEMENTS["request_claim"]), *claim)).split()[-1] != "1":
+                    return bool(await conn.fetchval(numbered(STATEMENTS["request_result"]), key)), True
+                await conn.execute(numbered(STATEMENTS["student_add"]), *student)
+                status = await conn.execute(numbered(sql), *params)
+                is_new = status.split()[-1] == "1"
+                if is_new:
+                    await conn.execute(numbered(STATEMENTS["totals_add"]), *stats[0])
+                    await conn.execute(numbered(STATEMENTS["sessions_add"]), *stats[1])
+                if key:
+                    await conn.execute(numbered(STATEMENTS["request_record"]), int(is_new), key)
+        return is_new, False
+
+    # One SQLite connection; the lock keeps each mark's statements together
+    async with _sqlite_lock:
+        await _sqlite.execute("BEGIN IMMEDIATE")
+        try:
+            if key and (await _sqlite.execute(STATEMENTS["request_claim"], claim)).rowcount != 1:
+                async with _sqlite.execute(STATEMENTS["request_result"], (key,)) as cur:
+                    stored = (await cur.fetchone())[0]
+                await _sqlite.rollback()
+                return bool(stored), True
+            await _sqlite.execute(STATEMENTS["student_add"], student)
+            cur = await _sqlite.execute(sql, params)
+            is_new = cur.rowcount == 1
+            if is_new:
+                await _sqlite.execute(STATEMENTS["totals_add"], stats[0])
+                await _sqlite.execute(STATEMENTS["sessions_add"], stats[1])
+            if key:
+                await _sqlite.execute(STATEMENTS["request_record"], (int(is_new), key))
+            await _sqlite.commit()
+        except Exception:
+            await _sqlite.rollback()
+            raise
+    return is_new, False
+
+
+async def _live_seed(subject, branch, date):
+    """Seed for app1.live_feed, fetched without blocking the loop (None if already seeded)"""
+    if app1.live_feed.has(subject, branch, date):
+        return None
+    params = (subject or '', branch or '', date)
+    if app1.USE_POSTGRES:
+        params = params[:2] + (datetime.date.fromisoformat(date),)
+        async with _pg_pool.acquire() as conn:
+            marks = await conn.fetchval(numbered(STATEMENTS["session_marks"]), *params)
+    else:
+        async with _sqlite.execute(STATEMENTS["session_marks"], params) as cur:
+            found = await cur.fetchone()
+        marks = found[0] if found else None
+    count = marks or 0
+    return lambda: count
+
+
+@quart_app.before_request
+async def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@quart_app.after_request
+async def _record_request_metrics(response):
+    # Same series as the Flask routes; database time isn't counted here
+    # because these handlers bypass attendance_db's timed cursor calls
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    app1.REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, route, request.method,
+                                 str(response.status_code))
+    return response
+
+
+def _event_stream(events):
+    return Response(events, mimetype="text/event-stream", headers={"Cache-Control": "no-store"})
+
+
+# ---------- SCAN & MARK ----------
+async def submit_scan(token, form, key=None):
+    """Async twin of app1.submit_scan"""
+    try:
+        qr = app1.scan_token(token, form=True)
+        subj, branch = qr["sub"] or None, qr["br"] or None
+        key = app1.check_request_key(key, qr["sid"])
+        fingerprint, device = app1.scan_device(request.remote_addr, request.headers, form)
+        app1.check_scan_rate(request.remote_addr, qr["sid"], form, fingerprint)
+        if app1.replayed_scan(key):
+            app1.SCAN_OUTCOMES.inc("replayed")
+            return "replayed"
+        session_key = app1.scan_session_key(subj, branch)
+        if session.get(session_key):
+            raise app1.RequestRejected(app1.ALREADY_MARKED_TODAY, outcome="duplicate")
+        row = app1.scan_row(form, subj, branch)
+        app1.check_recently_marked(row, device)
+    except app1.RequestRejected as e:
+        app1.SCAN_OUTCOMES.inc(e.outcome)
+        raise
+
+    roll, name, date = row[:3]
+    try:
+        started = time.perf_counter()
+        is_new, replayed = await mark_attendance(row, key)
+        app1.QUERY_SECONDS.observe(time.perf_counter() - started, "mark (async transaction)")
+        outcome = app1.scan_outcome(is_new, replayed)
+        # Read after the commit, so a fresh seed already includes this mark
+        seed = await _live_seed(subj, branch, date) if outcome == "new" else None
+    except Exception as e:
+        app1.SCAN_OUTCOMES.inc("error")
+        app1.log(f"SCAN ERROR: {e}")
+        raise
+    app1.remember_scan(row, device, key if is_new else None)
+    if key:
+        app1.schedule_request_expiry()
+
+    if outcome == "new":
+        app1.attendance_marked(subj, branch, date, roll, name, seed=seed)
+    app1.SCAN_OUTCOMES.inc(outcome)
+    session[session_key] = True
+    session.permanent = True
+    return outcome
+
+
+@quart_app.route("/scan", methods=["GET", "POST"])
+async def scan():
+    token = request.args.get("t", "")
+    if request.method == "POST":
+        form = await request.form
+        key = form.get("idempotency_key") or request.headers.get("Idempotency-Key")
+        try:
+            outcome = await submit_scan(token, form, key)
+        except app1.RequestRejected as e:
+            return e.message, e.status
+        except Exception as e:
+            return f"Error: {str(e)}", 500
+        if outcome == "duplicate":
+            return app1.ALREADY_MARKED
+        return await render_template("success.html")
+
+    try:
+        subj, branch = app1.check_scan_token(token)
+    except app1.RequestRejected as e:
+        app1.SCAN_OUTCOMES.inc(e.outcome)
+        return e.message, e.status
+    if session.get(app1.scan_session_key(subj, branch)):
+        app1.SCAN_OUTCOMES.inc("duplicate")
+        return app1.ALREADY_MARKED_TODAY
+    return await render_template("scan.html", token=app1.scan_form_token(token), subject=subj, branch=branch)
+
+
+@quart_app.route("/scan/batch", methods=["POST"])
+async def scan_batch():
+    try:
+        marks = app1.parse_scan_batch(await request.get_json(silent=True))
+    except app1.RequestRejected as e:
+        return jsonify({"error": e.message}), e.status
+    results = []
+    for mark in marks:
+        try:
+            results.append(app1.scan_result(mark, await submit_scan(mark.get("t", ""), mark, mark["idempotency_key"])))
+        except app1.RequestRejected as e:
+            results.append(app1.scan_result(mark, e.outcome, e.message, e.status))
+        except Exception as e:
+            results.append(app1.scan_result(mark, "error", f"Error: {str(e)}", 500))
+    return jsonify({"results": results})
+
+
+# ---------- GENERATE QR ----------
+@quart_app.route("/generate")
+async def generate():
+    if "admin" not in session:
+        return redirect("/")
+    subject, branch, fmt, rotate = app1.parse_generate_args(request.args)
+    # Rendering the QR is CPU work; keep it off the event loop
+    context = await asyncio.to_thread(app1.generate_context, subject, branch, fmt, rotate, request.host_url)
+    return await render_template("admin.html", **context)
+
+
+def _qr_args():
+    return (request.args.get("s", ""), request.args.get("rotate", 0, type=int),
+            request.args.get("fmt", "png"), request.host_url)
+
+
+@quart_app.route("/qr/stream")
+async def qr_stream():
+    """SSE feed of a rotating QR session, held open across rotations"""
+    if "admin" not in session:
+        return redirect("/")
+    args = _qr_args()
+    try:
+        state = await asyncio.to_thread(app1.rotating_qr_state, *args)
+    except TokenExpired:
+        return _event_stream("event: expired\ndata: {}\n\n")
+    except InvalidToken:
+        return "Invalid QR session", 403
+
+    async def events(state):
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while True:
+            yield f"id: {state['step']}\nretry: 1000\ndata: {json.dumps(state)}\n\n"
+            await asyncio.sleep(state["next_in_ms"] / 1000)
+            if time.monotonic() > deadline:
+                return
+            try:
+                state = await asyncio.to_thread(app1.rotating_qr_state, *args)
+            except InvalidToken:  # includes TokenExpired
+                yield "event: expired\ndata: {}\n\n"
+                return
+
+    return _event_stream(events(state))
+
+
+@quart_app.route("/qr/current")
+async def qr_current():
+    if "admin" not in session:
+        return redirect("/")
+    try:
+        state = await asyncio.to_thread(app1.rotating_qr_state, *_qr_args())
+    except TokenExpired:
+        state = {"expired": True}
+    except InvalidToken:
+        return jsonify({"error": "invalid QR session"}), 403
+    return jsonify(state), 200, {"Cache-Control": "no-store"}
+
+
+@quart_app.route("/qr.<fmt>")
+async def qr_image(fmt):
+    if "admin" not in session:
+        return redirect("/")
+    try:
+        data, remaining = await asyncio.to_thread(app1.load_qr_image, fmt, request.args)
+    except app1.RequestRejected as e:
+        return e.message, e.status
+    etag = hashlib.sha256(data).hexdigest()[:32]
+    headers = {"ETag": f'"{etag}"', "Cache-Control": f"private, max-age={remaining}"}
+    if etag in request.if_none_match:
+        return "", 304, headers
+    return Response(data, mimetype=MIMETYPES[fmt], headers=headers)
+
+
+# ---------- LIVE ATTENDANCE FEED ----------
+async def _live_snapshot():
+    subject = request.args.get("sub") or ''
+    branch = request.args.get("branch") or ''
+    date = app1.parse_date(request.args.get("date")) or datetime.date.today().isoformat()
+    seed = await _live_seed(subject, branch, date)
+    return subject, branch, date, app1.live_feed.snapshot(subject, branch, date, seed=seed)
+
+
+@quart_app.route("/live/stream")
+async def live_stream():
+    """SSE feed of the live count, pushed as marks arrive"""
+    if "admin" not in session:
+        return redirect("/")
+    subject, branch, date, state = await _live_snapshot()
+
+    async def events(state):
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        version = None
+        while time.monotonic() < deadline:
+            if state["version"] != version:
+                version = state["version"]
+                yield f"id: {version}\nretry: {app1.LIVE_REFRESH_MS}\ndata: {json.dumps(state)}\n\n"
+            await asyncio.sleep(LIVE_PUSH_MS / 1000)
+            seed = await _live_seed(subject, branch, date)  # the session may have been cleared
+            state = app1.live_feed.snapshot(subject, branch, date, seed=seed)
+
+    return _event_stream(events(state))
+
+
+@quart_app.route("/live/counts")
+async def live_counts():
+    if "admin" not in session:
+        return redirect("/")
+    state = (await _live_snapshot())[3]
+    return jsonify(dict(state, refresh_ms=app1.LIVE_REFRESH_MS)), 200, {"Cache-Control": "no-store"}
+
+
+# ---------- DISPATCH ----------
+_wsgi = WsgiToAsgi(app1.app)
+
+
+async def app(scope, receive, send):
+    """Route the hot paths to the async app and the rest to Flask"""
+    if scope["type"] == "http" and not scope["path"].startswith(ASYNC_PATHS):
+        await _wsgi(scope, receive, send)
+    else:
+        await quart_app(scope, receive, send)
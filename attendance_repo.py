@@ -0,0 +1,610 @@
+"""Data access for the attendance table, the student roster, the semester
+archive and the aggregate tables.
+
+Every statement is written once with ? placeholders and translated to the
+driver's parameter style the first time it runs, so routes no longer keep
+a Postgres and a SQLite copy of each query. Statement strings are stable,
+which lets sqlite3's per-connection statement cache reuse the compiled
+statements. On Postgres the hot statements can also be prepared on the
+server once per connection (DB_PREPARED_STATEMENTS=1); leave that off
+behind a transaction-mode pooler such as PgBouncer or Supavisor, which
+does not keep prepared statements between transactions.
+"""
+import collections
+import functools
+import re
+import time
+import weakref
+
+# Attendance rows carry the roll only; names come from the students roster
+ROW_COLUMNS = "a.roll, s.name, a.date, a.time, a.subject, a.branch"
+ROW_SOURCE = "attendance a LEFT JOIN students s ON s.roll = a.roll"
+ARCHIVE_SOURCE = "attendance_archive a LEFT JOIN students s ON s.roll = a.roll"
+
+# Archive term names double as Postgres partition names
+ARCHIVE_TERM = re.compile(r"^[a-z0-9][a-z0-9-]{0,39}$")
+# filters["term"] value that reads every archived term at once
+ARCHIVE_ALL = "all"
+MARK_COLUMNS = ("roll", "name", "date", "time", "subject", "branch")
+
+# Hot statements, run by name so they can be prepared per connection
+STATEMENTS = {
+    # params (roll, subject, branch, n) / (subject, branch, date, n)
+    "totals_add": """
+        INSERT INTO attendance_totals (roll, subject, branch, attended) VALUES (?,?,?,?)
+        ON CONFLICT (roll, subject, branch) DO UPDATE SET attended = attendance_totals.attended + excluded.attended
+    """,
+    "sessions_add": """
+        INSERT INTO sessions_held (subject, branch, date, marks) VALUES (?,?,?,?)
+        ON CONFLICT (subject, branch, date) DO UPDATE SET marks = sessions_held.marks + excluded.marks
+    """,
+    # params (n, roll, subject, branch) / (n, subject, branch, date)
+    "totals_sub": "UPDATE attendance_totals SET attended = attended - ? WHERE roll=? AND subject=? AND branch=?",
+    "sessions_sub": "UPDATE sessions_held SET marks = marks - ? WHERE subject=? AND branch=? AND date=?",
+    "session_marks": "SELECT marks FROM sessions_held WHERE subject=? AND branch=? AND date=?",
+    "delete_id": "DELETE FROM attendance WHERE id=?",
+    # params (stamp, id) / (id,)
+    "tombstone_id": "UPDATE attendance SET deleted_at=? WHERE id=? AND deleted_at IS NULL",
+    "restore_id": "UPDATE attendance SET deleted_at=NULL WHERE id=?",
+    # params (key, created_at) / (key,) / (is_new, key) / (created_before,)
+    "request_claim": "INSERT INTO scan_requests (request_key, created_at) VALUES (?,?) ON CONFLICT (request_key) DO NOTHING",
+    "request_result": "SELECT is_new FROM scan_requests WHERE request_key=?",
+    "request_record": "UPDATE scan_requests SET is_new=? WHERE request_key=?",
+    "request_expire": "DELETE FROM scan_requests WHERE created_at < ?",
+    # params (roll, name, branch); a scan never renames a known student
+    "student_add": "INSERT INTO students (roll, name, branch) VALUES (?,?,?) ON CONFLICT (roll) DO NOTHING",
+    # Roster import: the uploaded list is authoritative
+    "student_save": """
+        INSERT INTO students (roll, name, branch) VALUES (?,?,?)
+        ON CONFLICT (roll) DO UPDATE SET name = excluded.name, branch = COALESCE(excluded.branch, students.branch)
+    """,
+}
+
+
+@functools.lru_cache(maxsize=256)
+def numbered(sql):
+    """Rewrite ? placeholders as $1, $2, ... (PREPARE and asyncpg style)"""
+    n = iter(range(1, sql.count("?") + 1))
+    return re.sub(r"\?", lambda m: f"${next(n)}", sql)
+
+
+class AttendanceRepository:
+    """Attendance queries for one backend. Callers own connections and transactions."""
+
+    def __init__(self, postgres, prepare=False, log=None, observe=None):
+        self.postgres = postgres
+        self.prepare = postgres and prepare
+        self.log = log or (lambda msg: None)
+        # observe(name, sql, seconds) after each statement; name is None for ad-hoc SQL
+        self.observe = observe or (lambda name, sql, seconds: None)
+        self._compiled = {}
+        self._prepared = weakref.WeakKeyDictionary()  # connection -> statement names
+        self._columns = None
+        self._mark = None
+        self._schema_version = 0
+        self._name_search = self._name_search_sql(fts=False)
+
+    # ---------- statements ----------
+    def compile(self, sql):
+        """sql in this backend's parameter style, translated once per statement"""
+        compiled = self._compiled.get(sql)
+        if compiled is None:
+            compiled = sql.replace("?", "%s") if self.postgres else sql
+            self._compiled[sql] = compiled
+        return compiled
+
+    def execute(self, c, sql, params=(), name=None):
+        start = time.perf_counter()
+        c.execute(self.compile(sql), tuple(params))
+        self.observe(name, sql, time.perf_counter() - start)
+        return c
+
+    def run(self, c, name, params=()):
+        """Execute a named statement, preparing it on the connection first if enabled"""
+        if not self.prepare:
+            return self.execute(c, self._statement(name), params, name=name)
+        start = time.perf_counter()
+        c.execute(self._prepared_call(c, name, len(params)), tuple(params))
+        self.observe(name, self._statement(name), time.perf_counter() - start)
+        return c
+
+    def run_many(self, c, name, seq):
+        seq = [tuple(p) for p in seq]
+        if not seq:
+            return
+        start = time.perf_counter()
+        if self.prepare:
+            c.executemany(self._prepared_call(c, name, len(seq[0])), seq)
+        else:
+            c.executemany(self.compile(self._statement(name)), seq)
+        self.observe(name, self._statement(name), time.perf_counter() - start)
+
+    def _statement(self, name):
+        return self._mark[0] if name == "mark" else STATEMENTS[name]
+
+    def _prepared_call(self, c, name, nparams):
+        # PREPARE survives rollback, so a statement is prepared once per
+        # connection; the mark statement's name changes with the schema
+        key = f"attendance_{name}_{self._schema_version}" if name == "mark" else f"attendance_{name}"
+        names = self._prepared.setdefault(c.connection, set())
+        if key not in names:
+            c.execute(f"PREPARE {key} AS {numbered(self._statement(name))}")
+            names.add(key)
+        args = f" ({', '.join(['%s'] * nparams)})" if nparams else ""
+        return f"EXECUTE {key}{args}"
+
+    # ---------- schema cache ----------
+    # Column list of the attendance table and the mark statement chosen for
+    # it, loaded once (init_db) so marking never queries the catalog
+    def load_schema(self, c):
+        if self.postgres:
+            c.execute("SELECT column_name FROM information_schema.columns WHERE table_name='attendance'")
+            cols = [r[0] for r in c.fetchall()]
+        else:
+            c.execute("PRAGMA table_info(attendance)")
+            cols = [r[1] for r in c.fetchall()]
+        insert_keys = [k for k in MARK_COLUMNS if k in cols]
+        # The attendance_mark_key unique index turns a duplicate into a no-op, so
+        # checking and inserting is a single atomic statement
+        self._mark = (f"INSERT INTO attendance ({', '.join(insert_keys)}) "
+                      f"VALUES ({','.join(['?'] * len(insert_keys))}) ON CONFLICT DO NOTHING", insert_keys)
+        self._columns = cols
+        self._schema_version += 1
+        if not self.postgres:
+            c.execute("SELECT 1 FROM sqlite_master WHERE name='students_fts'")
+            self._name_search = self._name_search_sql(fts=c.fetchone() is not None)
+
+    def _name_search_sql(self, fts):
+        """Subquery of the rolls whose name contains the ? pattern"""
+        if self.postgres:
+            # Served by the students_name_trgm trigram index when pg_trgm is installed
+            return "SELECT roll FROM students WHERE name ILIKE ?"
+        if fts:
+            # FTS5 trigram table; LIKE on it is an index lookup for 3+ characters
+            return ("SELECT roll FROM students WHERE rowid IN "
+                    "(SELECT rowid FROM students_fts WHERE name LIKE ?)")
+        return "SELECT roll FROM students WHERE name LIKE ?"
+
+    def _schema_for(self, c, filters):
+        # Name search uses FTS5 only once load_schema() has seen the table,
+        # which a process started without migrating may not have run yet
+        if filters.get("name") and self._mark is None:
+            self.load_schema(c)
+
+    def invalidate_schema(self):
+        self._columns = None
+        self._mark = None
+
+    @property
+    def schema_loaded(self):
+        return self._mark is not None
+
+    def mark_statement(self):
+        """(?-style INSERT, column keys) of the mark statement; load_schema() must have run"""
+        return self._mark
+
+    # ---------- marking ----------
+    def mark(self, c, roll, name, date, time, subj, branch):
+        """Insert an attendance row unless one already exists.
+
+        Returns True if a new row was inserted, False for a duplicate.
+        """
+        if self._mark is None:
+            self.load_schema(c)
+        self.run(c, "student_add", (roll, name, branch))
+        values = {"roll": roll, "name": name, "date": date, "time": time, "subject": subj, "branch": branch}
+        self.run(c, "mark", [values[k] for k in self._mark[1]])
+        if c.rowcount != 1:
+            return False
+        self.update_stats(c, [(roll, date, subj, branch)], +1)
+        return True
+
+    def mark_many(self, c, rows):
+        """Mark many (roll, name, date, time, subject, branch) rows in one transaction.
+
+        Returns one bool per row, True where the row was newly inserted. Rows
+        repeated within the batch count as duplicates after their first
+        occurrence. Dates must be ISO 'YYYY-MM-DD' strings.
+        """
+        results = [False] * len(rows)
+        first = {}
+        for i, (roll, name, date, mark_time, subj, branch) in enumerate(rows):
+            first.setdefault((roll, date, subj or '', branch or ''), i)
+
+        if self._mark is None:
+            self.load_schema(c)
+        keys = self._mark[1]
+        # First name seen for each roll, in roll order like the aggregates
+        students = sorted({r[0]: (r[0], r[1], r[5]) for r in reversed(rows)}.values())
+        if self.postgres:
+            from psycopg2.extras import execute_values
+            execute_values(c, self.compile(STATEMENTS["student_add"]).replace("VALUES (%s,%s,%s)", "VALUES %s"),
+                           students, page_size=1000)
+            unique_rows = [dict(zip(MARK_COLUMNS, rows[i])) for i in first.values()]
+            inserted = execute_values(
+                c,
+                f"INSERT INTO attendance ({', '.join(keys)}) VALUES %s "
+                "ON CONFLICT DO NOTHING "
+                "RETURNING roll, to_char(date, 'YYYY-MM-DD'), COALESCE(subject, ''), COALESCE(branch, '')",
+                [[values[k] for k in keys] for values in unique_rows], page_size=len(unique_rows) or 1, fetch=True)
+            for key in inserted:
+                results[first[tuple(key)]] = True
+        else:
+            # SQLite statements are in-process; the cost saved is the commit
+            self.run_many(c, "student_add", students)
+            for i in first.values():
+                values = dict(zip(MARK_COLUMNS, rows[i]))
+                self.run(c, "mark", [values[k] for k in keys])
+                results[i] = c.rowcount == 1
+        self.update_stats(c, [(r[0], r[2], r[4], r[5]) for r, new in zip(rows, results) if new], +1)
+        return results
+
+    def mark_requests(self, c, requests, now=None):
+        """Mark (idempotency key or None, row) pairs in one transaction.
+
+        Each key is stored together with its mark, so a retried request is
+        answered from the first attempt instead of marking again. Returns
+        (is_new, replayed) per pair: replayed is True when the key was seen
+        before, and is_new is then the first attempt's result.
+        """
+        now = int(time.time()) if now is None else now
+        results = [None] * len(requests)
+        claimed = {}  # key -> index of the request that claimed it
+        fresh = []
+        for i, (key, row) in enumerate(requests):
+            if key is None:
+                fresh.append(i)
+            elif key not in claimed:
+                # Waits on a concurrent claim of the same key until it commits
+                self.run(c, "request_claim", (key, now))
+                if c.rowcount == 1:
+                    claimed[key] = i
+                    fresh.append(i)
+                else:
+                    self.run(c, "request_result", (key,))
+                    results[i] = (bool(c.fetchone()[0]), True)
+        if len(fresh) == 1:
+            marked = [self.mark(c, *requests[fresh[0]][1])]
+        else:
+            marked = self.mark_many(c, [requests[i][1] for i in fresh]) if fresh else []
+        for i, is_new in zip(fresh, marked):
+            results[i] = (is_new, False)
+        self.run_many(c, "request_record", [(int(results[i][0]), key) for key, i in claimed.items()])
+        # A key repeated within the batch replays its first occurrence
+        for i, (key, row) in enumerate(requests):
+            if results[i] is None:
+                results[i] = (results[claimed[key]][0], True)
+        return results
+
+    def expire_requests(self, c, before):
+        """Forget idempotency keys created before `before` (epoch seconds)"""
+        self.run(c, "request_expire", (before,))
+        return c.rowcount
+
+    # ---------- reading ----------
+    def _scope(self, filters):
+        """(table, row source, WHERE, params) for a /view or /export filter.
+
+        filters["term"] reads an archived term (or ARCHIVE_ALL) instead of the
+        live attendance table.
+        """
+        filters = dict(filters)
+        term = filters.pop("term", "")
+        where, params = self._filters(**filters, table="a")
+        if not term:
+            # Soft-deleted rows wait for the purge; the live-table indexes are
+            # partial on this same condition
+            return "attendance", ROW_SOURCE, where + " AND a.deleted_at IS NULL", params
+        if term != ARCHIVE_ALL:
+            where += " AND a.term = ?"
+            params.append(term)
+        return "attendance_archive", ARCHIVE_SOURCE, where, params
+
+    def _filters(self, subject='', branch='', name='', date_from='', date_to='', table=''):
+        """WHERE clause for a scope; table is the alias to qualify columns with.
+
+        Subject, branch and a date range make a range scan of the
+        attendance_subject_branch_recent index (subject, branch, date, ...).
+        """
+        col = f"{table}." if table else ""
+        where = " WHERE 1=1"
+        params = []
+        if subject:
+            where += f" AND {col}subject=?"
+            params.append(subject)
+        if branch:
+            where += f" AND {col}branch=?"
+            params.append(branch)
+        if date_from:
+            where += f" AND {col}date >= ?"
+            params.append(date_from)
+        if date_to:
+            where += f" AND {col}date <= ?"
+            params.append(date_to)
+        if name:
+            where += f" AND {col}roll IN ({self._name_search})"
+            params.append(f"%{name}%")
+        return where, params
+
+    def page(self, c, filters, after=None, before=None, limit=50):
+        """One newest-first page of (roll, name, date, time, subject, branch, id) rows.
+
+        Keyset pagination on (date, time, id): each page is an index range scan
+        starting at the cursor instead of an OFFSET over everything before it.
+        Rows after `before` are returned oldest-first.
+
+        Legacy rows whose date or time didn't parse (NULL) come after every
+        dated row, newest id first; a cursor on one of them is (None, None, id).
+        """
+        self._schema_for(c, filters)
+        _, source, where, params = self._scope(filters)
+        sql = f"SELECT {ROW_COLUMNS}, a.id FROM {source}" + where
+        dated = " AND a.date IS NOT NULL AND a.time IS NOT NULL"
+        undated = " AND (a.date IS NULL OR a.time IS NULL)"
+
+        def fetch(clause, args, n):
+            self.execute(c, sql + clause + " LIMIT ?", params + list(args) + [n])
+            return c.fetchall()
+
+        if before and before[0] is None:
+            rows = fetch(undated + " AND a.id > ? ORDER BY a.id ASC", before[2:], limit)
+            if len(rows) < limit:
+                rows += fetch(dated + " ORDER BY a.date ASC, a.time ASC, a.id ASC", (), limit - len(rows))
+            return rows
+        if before:
+            return fetch(dated + " AND (a.date, a.time, a.id) > (?, ?, ?) ORDER BY a.date ASC, a.time ASC, a.id ASC",
+                         before, limit)
+        if after and after[0] is None:
+            return fetch(undated + " AND a.id < ? ORDER BY a.id DESC", after[2:], limit)
+        if after:
+            rows = fetch(dated + " AND (a.date, a.time, a.id) < (?, ?, ?) ORDER BY a.date DESC, a.time DESC, a.id DESC",
+                         after, limit)
+        else:
+            rows = fetch(dated + " ORDER BY a.date DESC, a.time DESC, a.id DESC", (), limit)
+        if len(rows) < limit:
+            rows += fetch(undated + " ORDER BY a.id DESC", (), limit - len(rows))
+        return rows
+
+    def count(self, c, filters):
+        self._schema_for(c, filters)
+        table, _, where, params = self._scope(filters)
+        self.execute(c, f"SELECT COUNT(*) FROM {table} a" + where, params)
+        return c.fetchone()[0]
+
+    def iter_export(self, conn, filters, fetch_size=2000):
+        """Yield export rows newest-first, holding one batch in memory at a time"""
+        _, source, where, params = self._scope(filters)
+        if self.postgres:
+            # Named cursor: rows stay on the server and arrive itersize at a time
+            c = conn.cursor(name="attendance_export")
+            c.itersize = fetch_size
+        else:
+            c = conn.cursor()
+        self.execute(c, f"SELECT {ROW_COLUMNS} FROM {source}{where} "
+                        "ORDER BY a.date DESC, a.time DESC, a.id DESC", params)
+        for row in c:
+            yield row
+        c.close()
+
+    # ---------- students ----------
+    def find_students(self, c, roll='', name=''):
+        """(roll, name, branch) of the student with this roll, or of every
+        student whose roll or (case-insensitive) name equals `name`"""
+        if roll:
+            self.execute(c, "SELECT roll, name, branch FROM students WHERE roll=?", (roll,))
+        else:
+            self.execute(c, "SELECT roll, name, branch FROM students WHERE roll=? OR lower(name)=lower(?) "
+                            "ORDER BY roll", (name, name))
+        return c.fetchall()
+
+    def save_students(self, c, students):
+        """Insert or update (roll, name, branch) roster entries"""
+        self.run_many(c, "student_save", sorted({s[0]: s for s in students}.values()))
+
+    def student_rows(self, c, rolls, subject=''):
+        sql = (f"SELECT {ROW_COLUMNS} FROM {ROW_SOURCE} "
+               f"WHERE a.roll IN ({','.join(['?'] * len(rolls))}) AND a.deleted_at IS NULL")
+        params = list(rolls)
+        if subject:
+            sql += " AND a.subject=?"
+            params.append(subject)
+        self.execute(c, sql + " ORDER BY a.date DESC, a.time DESC", params)
+        return c.fetchall()
+
+    def student_stats(self, c, rolls):
+        """(subject, branch, attended, held) per subject/branch for the given rolls, from the aggregates"""
+        self.execute(c, f"""
+            SELECT t.subject, t.branch, SUM(t.attended),
+                   (SELECT COUNT(*) FROM sessions_held s WHERE s.subject = t.subject AND s.branch = t.branch)
+            FROM attendance_totals t
+            WHERE t.roll IN ({','.join(['?'] * len(rolls))})
+            GROUP BY t.subject, t.branch
+            ORDER BY t.subject, t.branch
+        """, rolls)
+        return c.fetchall()
+
+    def session_marks(self, c, subject, branch, date):
+        """Marks recorded for one class session (subject, branch, date)"""
+        self.run(c, "session_marks", (subject or '', branch or '', date))
+        row = c.fetchone()
+        return row[0] if row else 0
+
+    # ---------- deleting ----------
+    # Deletes run in bounded batches chosen by primary key, one transaction
+    # each, so a large clear never holds the write lock for long. With a
+    # stamp (epoch microseconds) rows are only tombstoned: deleted_at is set,
+    # every read skips them, and restore_chunk() can bring the whole deletion
+    # back until purge_chunk() removes rows whose stamp is past the undo window.
+    def delete_ids(self, c, ids, stamp=None):
+        """Delete live rows by primary key; returns the (subject, branch) of each row that went"""
+        if not ids:
+            return []
+        self.execute(c, f"SELECT id, roll, date, subject, branch FROM attendance "
+                        f"WHERE id IN ({','.join(['?'] * len(ids))}) AND deleted_at IS NULL", ids)
+        rows = c.fetchall()
+        self.delete_rows(c, rows, stamp)
+        return [(r[3], r[4]) for r in rows]
+
+    def delete_chunk(self, c, subject='', branch='', stamp=None, limit=1000):
+        """Delete up to `limit` live rows of a subject/branch scope ('' matches any)"""
+        where, params = self._filters(subject, branch)
+        self.execute(c, f"SELECT id, roll, date, subject, branch FROM attendance{where} "
+                        "AND deleted_at IS NULL LIMIT ?", params + [limit])
+        rows = c.fetchall()
+        self.delete_rows(c, rows, stamp)
+        return len(rows)
+
+    def delete_rows(self, c, rows, stamp=None):
+        """Delete (id, roll, date, subject, branch) rows by primary key and update the aggregates"""
+        if not rows:
+            return
+        if stamp is None:
+            self.run_many(c, "delete_id", [(r[0],) for r in rows])
+        else:
+            self.run_many(c, "tombstone_id", [(stamp, r[0]) for r in rows])
+        self.update_stats(c, [r[1:] for r in rows], -1)
+
+    def restore_chunk(self, c, stamp, limit=1000):
+        """Bring back up to `limit` rows tombstoned with `stamp`.
+
+        A row whose mark was made again since it was deleted stays deleted.
+        """
+        self.execute(c, """
+            SELECT id, roll, date, subject, branch FROM attendance a WHERE deleted_at = ?
+            AND NOT EXISTS (SELECT 1 FROM attendance b WHERE b.deleted_at IS NULL
+                            AND b.roll = a.roll AND b.date = a.date
+                            AND COALESCE(b.subject, '') = COALESCE(a.subject, '')
+                            AND COALESCE(b.branch, '') = COALESCE(a.branch, ''))
+            LIMIT ?
+        """, (stamp, limit))
+        rows = c.fetchall()
+        if rows:
+            self.run_many(c, "restore_id", [(r[0],) for r in rows])
+            self.update_stats(c, [r[1:] for r in rows], +1)
+        return len(rows)
+
+    def purge_chunk(self, c, before_stamp, limit=1000):
+        """Remove up to `limit` rows tombstoned before `before_stamp` for good"""
+        self.execute(c, "SELECT id FROM attendance WHERE deleted_at < ? LIMIT ?", (before_stamp, limit))
+        ids = c.fetchall()
+        self.run_many(c, "delete_id", ids)
+        return len(ids)
+
+    def oldest_tombstone(self, c):
+        """Smallest deleted_at still waiting to be purged, or None"""
+        c.execute("SELECT MIN(deleted_at) FROM attendance WHERE deleted_at IS NOT NULL")
+        return c.fetchone()[0]
+
+    # ---------- archive ----------
+    # Rows older than a cutoff move to attendance_archive under a term name.
+    # On Postgres that table is list-partitioned by term; on SQLite it lives
+    # in a separate database file attached to every connection as "archive".
+    def archive_terms(self, c):
+        """(term, cutoff, marks) of every archived term, newest first"""
+        self.execute(c, "SELECT term, cutoff, marks FROM archive_terms ORDER BY cutoff DESC, term")
+        return c.fetchall()
+
+    def prepare_archive(self, c, term):
+        """Create the term's partition (Postgres) before rows are moved into it"""
+        if not ARCHIVE_TERM.match(term):
+            raise ValueError(f"invalid archive term: {term!r}")
+        if self.postgres:
+            c.execute(f"CREATE TABLE IF NOT EXISTS attendance_archive_{term.replace('-', '_')} "
+                      "PARTITION OF attendance_archive FOR VALUES IN (%s)", (term,))
+
+    def archive_chunk(self, c, term, before, limit=1000):
+        """Move up to `limit` of the oldest rows dated before `before` into the
+        archive under `term`; returns how many moved (0 when done).
+
+        Rows leave the aggregates as they leave the table, so student
+        percentages cover the current term only. Only atomic where the
+        archive shares a transaction with the live table (Postgres); see
+        archive_copy.
+        """
+        return self.archive_remove(c, term, before, self.archive_copy(c, term, before, limit))
+
+    def archive_copy(self, c, term, before, limit=1000):
+        """Copy up to `limit` of the oldest live rows dated before `before` into
+        the archive under `term`; returns their ids.
+
+        On SQLite the archive is another database file, and a transaction
+        spanning WAL databases isn't atomic across them. Commit the copy on
+        its own before archive_remove deletes the originals, so a crash in
+        between leaves rows in both places rather than in neither.
+        """
+        self.execute(c, "SELECT id FROM attendance "
+                        "WHERE date < ? AND deleted_at IS NULL ORDER BY date, time, id LIMIT ?", (before, limit))
+        ids = [r[0] for r in c.fetchall()]
+        if ids:
+            # A row already copied by an interrupted run is skipped, then removed
+            self.execute(c, f"""
+                INSERT INTO attendance_archive (term, id, roll, date, time, subject, branch)
+                SELECT ?, id, roll, date, time, subject, branch FROM attendance
+                WHERE id IN ({','.join(['?'] * len(ids))})
+                ON CONFLICT DO NOTHING
+            """, [term] + ids)
+        return ids
+
+    def archive_remove(self, c, term, before, ids):
+        """Delete the rows archive_copy copied; returns how many went"""
+        if not ids:
+            return 0
+        placeholders = ','.join(['?'] * len(ids))
+        self.execute(c, f"SELECT id, roll, date, subject, branch FROM attendance "
+                        f"WHERE id IN ({placeholders}) AND deleted_at IS NULL", ids)
+        rows = c.fetchall()
+        gone = set(ids) - {r[0] for r in rows}
+        if gone:
+            # Deleted since the copy committed; the archive shouldn't keep them
+            self.execute(c, f"DELETE FROM attendance_archive WHERE term = ? "
+                            f"AND id IN ({','.join(['?'] * len(gone))})", [term] + sorted(gone))
+        self.delete_rows(c, rows)
+        self.execute(c, """
+            INSERT INTO archive_terms (term, cutoff, marks) VALUES (?,?,?)
+            ON CONFLICT (term) DO UPDATE SET cutoff = excluded.cutoff, marks = archive_terms.marks + excluded.marks
+        """, (term, before, len(rows)))
+        return len(rows)
+
+    # ---------- statistics ----------
+    def rebuild_stats(self, c):
+        """Recompute attendance_totals and sessions_held from the attendance table"""
+        c.execute("DELETE FROM attendance_totals")
+        c.execute("DELETE FROM sessions_held")
+        c.execute("""
+            INSERT INTO attendance_totals (roll, subject, branch, attended)
+            SELECT roll, COALESCE(subject, ''), COALESCE(branch, ''), COUNT(*)
+            FROM attendance WHERE deleted_at IS NULL
+            GROUP BY roll, COALESCE(subject, ''), COALESCE(branch, '')
+        """)
+        c.execute("""
+            INSERT INTO sessions_held (subject, branch, date, marks)
+            SELECT COALESCE(subject, ''), COALESCE(branch, ''), date, COUNT(*)
+            FROM attendance WHERE date IS NOT NULL AND deleted_at IS NULL
+            GROUP BY COALESCE(subject, ''), COALESCE(branch, ''), date
+        """)
+
+    def update_stats(self, c, marks, delta):
+        """Apply +1/-1 per (roll, date, subject, branch) mark to the aggregate tables"""
+        if not marks:
+            return
+        # One statement per aggregate row, in key order so concurrent batches
+        # lock rows in the same order
+        totals = sorted(collections.Counter(
+            (roll, subj or '', branch or '') for roll, date, subj, branch in marks).items())
+        sessions = sorted(collections.Counter(
+            (subj or '', branch or '', date) for roll, date, subj, branch in marks).items())
+        if delta > 0:
+            if self.postgres and len(marks) > 1:
+                # One round trip per page instead of per row
+                from psycopg2.extras import execute_values
+                for name, rows in (("totals_add", totals), ("sessions_add", sessions)):
+                    sql = self.compile(STATEMENTS[name]).replace("VALUES (%s,%s,%s,%s)", "VALUES %s")
+                    execute_values(c, sql, [key + (n,) for key, n in rows], page_size=1000)
+            else:
+                self.run_many(c, "totals_add", [key + (n,) for key, n in totals])
+                self.run_many(c, "sessions_add", [key + (n,) for key, n in sessions])
+        else:
+            self.run_many(c, "totals_sub", [(n,) + key for key, n in totals])
+            self.run_many(c, "sessions_sub", [(n,) + key for key, n in sessions])
+            c.execute("DELETE FROM attendance_totals WHERE attended <= 0")
+            c.execute("DELETE FROM sessions_held WHERE marks <= 0")
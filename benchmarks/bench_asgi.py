@@ -0,0 +1,163 @@
+"""Load benchmark: threaded WSGI server vs. the async ASGI entry point.
+
+Starts the app as a real HTTP server - app1.app on Werkzeug's threaded
+server, then asgi_app.app on uvicorn - and fires a burst of concurrent
+/scan POSTs at it from an asyncio client, one connection per scanner, the
+way a room of phones hits the server when a QR goes up.
+
+    python benchmarks/bench_asgi.py --scanners 500
+    python benchmarks/bench_asgi.py --postgres postgresql://user@localhost/db
+
+Needs the packages in requirements-async.txt.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_ingest import percentile  # noqa: E402
+
+WSGI_SERVER = (
+    "import sys, app1; from werkzeug.serving import make_server; "
+    "make_server('127.0.0.1', int(sys.argv[1]), app1.app, threaded=True).serve_forever()"
+)
+PREPARE = (
+    "import app1; conn = app1.get_db_connection(); c = conn.cursor(); "
+    "c.execute('DELETE FROM attendance'); c.execute('DELETE FROM attendance_totals'); "
+    "c.execute('DELETE FROM sessions_held'); conn.commit(); conn.close(); "
+    "print(app1.issue_token(app1.QR_TOKEN_SECRET, 'BENCH', 'CSE-A', ttl=3600))"
+)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def post(port, path, body, timeout):
+    """One POST on its own connection; returns (seconds, status, body)"""
+    start = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+    try:
+        writer.write((f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nConnection: close\r\n"
+                      f"Content-Type: application/x-www-form-urlencoded\r\n"
+                      f"Content-Length: {len(body)}\r\n\r\n").encode() + body)
+        await writer.drain()
+        raw = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head, _, payload = raw.partition(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1]) if head else 0
+    return time.perf_counter() - start, status, payload.decode(errors="replace")
+
+
+async def scan_burst(port, token, scanners, unique, timeout):
+    path = f"/scan?t={token}"
+
+    async def one(i):
+        body = urllib.parse.urlencode({"roll": f"R{i % unique}", "name": f"Student {i}", "device": f"bench-{i}"}).encode()
+        try:
+            elapsed, status, text = await post(port, path, body, timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None, "error"
+        if "Already Marked" in text:
+            return elapsed, "duplicate"
+        if status == 200 and "Error" not in text[:10]:
+            return elapsed, "new"
+        return elapsed, "error"
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(scanners)))
+    wall = time.perf_counter() - start
+    latencies = [r[0] for r in results if r[0] is not None]
+    outcomes = {k: sum(1 for r in results if r[1] == k) for k in ("new", "duplicate", "error")}
+    return {
+        "requests": scanners,
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(scanners / wall, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        **outcomes,
+    }
+
+
+def wait_for_port(port, proc, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def run_server(args, server, env):
+    token = subprocess.run([sys.executable, "-c", PREPARE], cwd=ROOT, env=env, check=True,
+                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.split()[-1]
+    port = free_port()
+    if server == "wsgi":
+        cmd = [sys.executable, "-c", WSGI_SERVER, str(port)]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi_app:app", "--port", str(port),
+               "--log-level", "warning", "--backlog", "4096"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, proc)
+        return asyncio.run(scan_burst(port, token, args.scanners, args.unique, args.timeout))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scanners", type=int, default=500, help="concurrent scan POSTs")
+    parser.add_argument("--unique", type=int, default=None,
+                        help="distinct roll numbers (fewer than --scanners produces duplicates)")
+    parser.add_argument("--pool-size", type=int, default=10, help="DB_POOL_SIZE for the app")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout in seconds")
+    parser.add_argument("--postgres", default=os.environ.get("DATABASE_URL"),
+                        help="also benchmark this Postgres URL (default: $DATABASE_URL)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+    args.unique = args.unique or args.scanners
+
+    backends = ["sqlite"] + (["postgres"] if args.postgres else [])
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in backends:
+            env = dict(os.environ, DB_POOL_SIZE=str(args.pool_size), SCAN_WRITE_BEHIND="0",
+                       SCAN_RATE_LIMIT="0", SCAN_ADDRESS_RATE_LIMIT="0")
+            env.pop("DATABASE_URL", None)
+            if backend == "postgres":
+                env["DATABASE_URL"] = args.postgres
+            else:
+                env["SQLITE_PATH"] = os.path.join(tmp, "bench.db")
+            for server in ("wsgi", "asgi"):
+                results.append(dict(run_server(args, server, env), backend=backend, server=server))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.scanners} concurrent scanners\n")
+    print(f"{'backend':<10}{'server':<8}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'new':>6}{'dup':>6}{'err':>6}")
+    for r in results:
+        print(f"{r['backend']:<10}{r['server']:<8}{r['requests_per_s']:>9}{r['p50_ms']:>10}{r['p99_ms']:>10}"
+              f"{r['new']:>6}{r['duplicate']:>6}{r['error']:>6}")
+
+
+if __name__ == "__main__":
+    main()
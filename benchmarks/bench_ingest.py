@@ -0,0 +1,135 @@
+"""Load benchmark: per-request commits vs. the write-behind scan queue.
+
+Simulates a lecture hall scanning one QR: N students POST /scan through the
+Flask test client from a pool of concurrent threads. Each configuration runs
+in its own process because app1 reads its settings at import time.
+
+    python benchmarks/bench_ingest.py --students 300 --concurrency 50
+    python benchmarks/bench_ingest.py --postgres postgresql://user@localhost/db
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_TAG = "BENCH_RESULT "
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(pct / 100.0 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+def run_child(args):
+    sys.path.insert(0, ROOT)
+    import app1
+
+    conn = app1.get_db_connection()
+    conn.cursor().execute("DELETE FROM attendance")
+    conn.commit()
+    conn.close()
+
+    app1.app.testing = True
+    token = app1.issue_token(app1.QR_TOKEN_SECRET, "BENCH", "CSE-A", ttl=3600)
+    url = f"/scan?t={token}"
+
+    def one_scan(i):
+        client = app1.app.test_client()
+        start = time.perf_counter()
+        resp = client.post(url, data={"roll": f"R{i % args.unique}", "name": f"Student {i}",
+                                       "device": f"bench-{i}"})
+        elapsed = time.perf_counter() - start
+        body = resp.get_data(as_text=True)
+        if "Already Marked" in body:
+            outcome = "duplicate"
+        elif resp.status_code == 200 and "Error" not in body[:10]:
+            outcome = "new"
+        else:
+            outcome = "error"
+        return elapsed, outcome
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(one_scan, range(args.students)))
+    wall = time.perf_counter() - start
+
+    latencies = [r[0] for r in results]
+    outcomes = {k: sum(1 for r in results if r[1] == k) for k in ("new", "duplicate", "error")}
+    if app1.SCAN_WRITE_BEHIND:
+        commits = app1.get_ingest_queue().stats()["batches"]
+    else:
+        commits = outcomes["new"] + outcomes["duplicate"]
+
+    print(RESULT_TAG + json.dumps({
+        "requests": len(results),
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(len(results) / wall, 1),
+        "commits": commits,
+        "commits_per_s": round(commits / wall, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        **outcomes,
+    }), flush=True)
+
+
+def run_config(args, backend, write_behind, sqlite_path):
+    env = dict(os.environ)
+    env.pop("DATABASE_URL", None)
+    if backend == "postgres":
+        env["DATABASE_URL"] = args.postgres
+    else:
+        env["SQLITE_PATH"] = sqlite_path
+    env["SCAN_WRITE_BEHIND"] = "1" if write_behind else "0"
+    env["DB_POOL_SIZE"] = str(args.pool_size)
+    # Every simulated student posts from this host in one QR session
+    env["SCAN_RATE_LIMIT"] = env["SCAN_ADDRESS_RATE_LIMIT"] = "0"
+    cmd = [sys.executable, os.path.abspath(__file__), "--child",
+           "--students", str(args.students), "--concurrency", str(args.concurrency),
+           "--unique", str(args.unique)]
+    proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_TAG):
+            return json.loads(line[len(RESULT_TAG):])
+    raise RuntimeError(f"{backend} benchmark run failed (exit code {proc.returncode})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=300, help="scan POSTs to send")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent scanning clients")
+    parser.add_argument("--unique", type=int, default=None,
+                        help="distinct roll numbers (fewer than --students produces duplicates)")
+    parser.add_argument("--pool-size", type=int, default=10, help="DB_POOL_SIZE for the app")
+    parser.add_argument("--postgres", default=os.environ.get("DATABASE_URL"),
+                        help="also benchmark this Postgres URL (default: $DATABASE_URL)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.unique = args.unique or args.students
+
+    if args.child:
+        run_child(args)
+        return
+
+    backends = ["sqlite"] + (["postgres"] if args.postgres else [])
+    print(f"{args.students} scans, {args.concurrency} concurrent clients\n")
+    print(f"{'backend':<10}{'mode':<15}{'req/s':>9}{'commits/s':>11}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'new':>6}{'dup':>6}{'err':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in backends:
+            for write_behind in (False, True):
+                r = run_config(args, backend, write_behind, os.path.join(tmp, f"bench-{write_behind}.db"))
+                mode = "write-behind" if write_behind else "per-request"
+                print(f"{backend:<10}{mode:<15}{r['requests_per_s']:>9}{r['commits_per_s']:>11}"
+                      f"{r['p50_ms']:>9}{r['p99_ms']:>9}{r['new']:>6}{r['duplicate']:>6}{r['error']:>6}")
+
+
+if __name__ == "__main__":
+    main()
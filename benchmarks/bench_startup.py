@@ -0,0 +1,118 @@
+"""Cold-start benchmark: how long a fresh process takes to serve its first request.
+
+Each sample is a new Python process that imports app1 and answers one
+GET /scan through the test client, the way a serverless instance wakes up
+for a student opening the QR link. Reports the median process time, the
+import and first-request split, and which heavy modules were loaded by
+then. The database is migrated once before sampling, so the numbers are
+for an ordinary cold start rather than a first deploy.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --rev HEAD~1     # compare with an older version
+    python benchmarks/bench_startup.py --postgres postgresql://user@localhost/db --json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_ingest import RESULT_TAG, ROOT  # noqa: E402
+
+HEAVY_MODULES = ("qrcode", "PIL", "dotenv", "csv", "exporters", "importers", "psycopg2")
+
+SAMPLE = f"""
+import json, sys, time
+started = time.perf_counter()
+import app1
+imported = time.perf_counter()
+token = app1.issue_token(app1.QR_TOKEN_SECRET, "BENCH", "CSE-A", ttl=60)
+status = app1.app.test_client().get("/scan?t=" + token).status_code
+served = time.perf_counter()
+print({RESULT_TAG!r} + json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (served - imported) * 1000,
+    "status": status,
+    "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def sample(tree, env):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", SAMPLE], cwd=tree, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    wall = (time.perf_counter() - start) * 1000
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_TAG):
+            return dict(json.loads(line[len(RESULT_TAG):]), process_ms=wall)
+    raise RuntimeError(f"startup sample in {tree} failed (exit code {proc.returncode})")
+
+
+def measure(label, tree, env, runs):
+    # Create or migrate the schema first, outside the measured runs
+    subprocess.run([sys.executable, "-c", "import app1"], cwd=tree, env=dict(env, AUTO_MIGRATE="1"),
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    samples = [sample(tree, env) for _ in range(runs)]
+    if any(s["status"] != 200 for s in samples):
+        raise RuntimeError(f"{label}: first request failed with status {samples[0]['status']}")
+    return {
+        "version": label,
+        "process_ms": round(statistics.median(s["process_ms"] for s in samples), 1),
+        "import_ms": round(statistics.median(s["import_ms"] for s in samples), 1),
+        "first_request_ms": round(statistics.median(s["first_request_ms"] for s in samples), 1),
+        "heavy_modules": samples[-1]["heavy"],
+    }
+
+
+def export_rev(rev, dest):
+    """Check out git revision rev into dest (without touching the working tree)"""
+    archive = subprocess.run(["git", "archive", rev], cwd=ROOT, check=True, stdout=subprocess.PIPE).stdout
+    subprocess.run(["tar", "-x", "-C", dest], input=archive, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=7, help="cold starts sampled per configuration")
+    parser.add_argument("--rev", help="also measure this git revision, e.g. HEAD~1")
+    parser.add_argument("--postgres", default=os.environ.get("DATABASE_URL"),
+                        help="measure against this Postgres URL instead of SQLite (default: $DATABASE_URL)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        def env_for(name, **extra):
+            env = dict(os.environ, **extra)
+            env.pop("DATABASE_URL", None)
+            if args.postgres:
+                env["DATABASE_URL"] = args.postgres
+            else:
+                env["SQLITE_PATH"] = os.path.join(tmp, f"{name}.db")
+            return env
+
+        if args.rev:
+            old = os.path.join(tmp, "rev")
+            os.mkdir(old)
+            export_rev(args.rev, old)
+            results.append(measure(args.rev, old, env_for("rev"), args.runs))
+        results.append(measure("working tree", ROOT, env_for("tree"), args.runs))
+        results.append(measure("working tree, AUTO_MIGRATE=0", ROOT, env_for("tree", AUTO_MIGRATE="0"), args.runs))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"median of {args.runs} cold starts, {'postgres' if args.postgres else 'sqlite'}\n")
+    print(f"{'version':<32}{'process ms':>12}{'import ms':>11}{'1st req ms':>12}  heavy modules loaded")
+    for r in results:
+        print(f"{r['version']:<32}{r['process_ms']:>12}{r['import_ms']:>11}{r['first_request_ms']:>12}  "
+              f"{', '.join(r['heavy_modules']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""Load test: a lecture-hall scan burst plus admins reading records.
+
+Each run seeds a fresh database with --rows historical marks, then plays
+the scenarios one after another:
+
+  scan    --students scan POSTs of one QR from --concurrency clients, all
+          inside the QR's expiry window
+  view    --admins admins each paging --pages deep through /view
+  export  --exports concurrent full /export downloads
+
+against every backend (SQLite, plus Postgres with --postgres) and every
+transport: the Flask test client in-process, and a real threaded HTTP
+server in its own process. Each (backend, transport) pair runs in its own
+process because app1 reads its settings at import time.
+
+    python benchmarks/loadtest.py
+    python benchmarks/loadtest.py --postgres postgresql://user@localhost/db --out after.json
+    python benchmarks/loadtest.py --scenarios scan --students 1000 --compare before.json
+
+Results (throughput, p50/p95/p99 latency, error and lock rates) are printed
+as a table and, with --out, saved as JSON for comparison between versions.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import http.client
+import json
+import os
+import platform
+import re
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_asgi import WSGI_SERVER, free_port, wait_for_port  # noqa: E402
+from bench_ingest import RESULT_TAG, ROOT, percentile  # noqa: E402
+
+SCENARIOS = ("scan", "view", "export")
+TRANSPORTS = ("client", "http")
+SUBJECTS = ("DBMS", "OS", "CN", "AI")
+BRANCHES = ("CSE-A", "CSM", "ECE")
+SEED_BATCH = 1000
+NEXT_PAGE = re.compile(r'after=([^"&]+)')
+
+
+# ---------- clients ----------
+class TestClientUser:
+    """One simulated user talking to app1.app through the Flask test client"""
+
+    def __init__(self, app1, admin=False):
+        self.client = app1.app.test_client()
+        if admin:
+            with self.client.session_transaction() as sess:
+                sess["admin"] = True
+
+    def request(self, method, path, data=None):
+        resp = self.client.open(path, method=method, data=data)
+        return resp.status_code, resp.get_data()
+
+
+class HTTPUser:
+    """One simulated user talking to the app over HTTP, a new connection per request"""
+
+    def __init__(self, port, timeout, admin=False):
+        self.port = port
+        self.timeout = timeout
+        self.cookie = None
+        if admin:
+            self.request("POST", "/", {"username": "admin", "password": "admin123"})
+
+    def request(self, method, path, data=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.timeout)
+        headers = {"Cookie": self.cookie} if self.cookie else {}
+        body = None
+        if data is not None:
+            body = urllib.parse.urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            payload = resp.read()
+            cookie = resp.getheader("Set-Cookie")
+            if cookie:
+                self.cookie = cookie.split(";", 1)[0]
+            return resp.status, payload
+        finally:
+            conn.close()
+
+
+# ---------- scenarios ----------
+def outcome(status, body):
+    text = body[:200].decode(errors="replace")
+    if "locked" in text.lower():
+        return "locked"
+    if status >= 400 or text.startswith("Error"):
+        return "error"
+    if "Already Marked" in text:
+        return "duplicate"
+    return "ok"
+
+
+def timed(user, method, path, data=None):
+    """(seconds, outcome, bytes, body) for one request; transport failures count as errors"""
+    start = time.perf_counter()
+    try:
+        status, body = user.request(method, path, data)
+    except (OSError, http.client.HTTPException):
+        return time.perf_counter() - start, "error", 0, b""
+    return time.perf_counter() - start, outcome(status, body), len(body), body
+
+
+def scan_scenario(args, new_user, token):
+    path = f"/scan?t={token}"
+    today = datetime.date.today().isoformat()
+    run = secrets.token_hex(4)  # fresh idempotency keys for every run
+
+    def one(i):
+        # A fresh session per scan, like a room of different phones
+        return timed(new_user(), "POST", path, {"roll": f"L{i}", "name": f"Load {i}", "local_date": today,
+                                                     "device": f"load-{i}", "idempotency_key": f"load-{run}-{i}"})
+
+    with concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+        return list(pool.map(one, range(args.students)))
+
+
+def view_scenario(args, new_user, token):
+    def walk(i):
+        user = new_user(admin=True)
+        # Half the admins look at one class, the rest at everything
+        query = {"per_page": 50}
+        if i % 2:
+            query.update(sub=SUBJECTS[i % len(SUBJECTS)], branch=BRANCHES[i % len(BRANCHES)])
+        path = "/view?" + urllib.parse.urlencode(query)
+        results = []
+        for _ in range(args.pages):
+            r = timed(user, "GET", path)
+            results.append(r)
+            found = NEXT_PAGE.search(r[3].decode(errors="replace"))
+            if not found:
+                break
+            path = "/view?" + urllib.parse.urlencode(query) + "&after=" + found.group(1)
+        return results
+
+    with concurrent.futures.ThreadPoolExecutor(args.admins) as pool:
+        return [r for walk_results in pool.map(walk, range(args.admins)) for r in walk_results]
+
+
+def export_scenario(args, new_user, token):
+    def one(i):
+        return timed(new_user(admin=True), "GET", "/export")
+
+    with concurrent.futures.ThreadPoolExecutor(args.exports) as pool:
+        return list(pool.map(one, range(args.exports)))
+
+
+def summarize(scenario, results, wall):
+    latencies = [r[0] for r in results]
+    counts = {k: sum(1 for r in results if r[1] == k) for k in ("ok", "duplicate", "error", "locked")}
+    n = len(results) or 1
+    return {
+        "scenario": scenario,
+        "requests": len(results),
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(len(results) / wall, 1) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        **counts,
+        "error_rate": round(counts["error"] / n, 4),
+        "lock_rate": round(counts["locked"] / n, 4),
+        "mb": round(sum(r[2] for r in results) / 1e6, 2),
+        # A few failing responses, so a regression can be diagnosed from the JSON
+        "error_samples": [r[3][:200].decode(errors="replace") for r in results if r[1] in ("error", "locked")][:3],
+    }
+
+
+# ---------- child: one backend/transport pair ----------
+def seed(app1, rows):
+    """Empty the live tables and load `rows` marks spread over the last 120 days"""
+    with app1.db_writer() as c:
+        for table in ("attendance", "attendance_totals", "sessions_held"):
+            c.execute(f"DELETE FROM {table}")
+    today = datetime.date.today()
+    batch = []
+    for i in range(rows):
+        date = (today - datetime.timedelta(days=1 + i % 120)).isoformat()
+        batch.append((f"S{i % 2000}", f"Student {i % 2000}", date, f"{9 + i % 8:02d}:00:00",
+                      SUBJECTS[i % len(SUBJECTS)], BRANCHES[i % len(BRANCHES)]))
+        if len(batch) == SEED_BATCH or i == rows - 1:
+            with app1.db_writer() as c:
+                app1.attendance_db.mark_many(c, batch)
+            batch = []
+    app1.attendance_removed()
+
+
+def run_child(args):
+    sys.path.insert(0, ROOT)
+    import app1
+
+    app1.app.testing = True
+    seed(app1, args.rows)
+    token = app1.issue_token(app1.QR_TOKEN_SECRET, "LOADTEST", "CSE-A", ttl=app1.QR_TTL_SECONDS)
+    server = None
+    if args.transport == "http":
+        port = free_port()
+        server = subprocess.Popen([sys.executable, "-c", WSGI_SERVER, str(port)], cwd=ROOT,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_port(port, server)
+
+        def new_user(admin=False):
+            return HTTPUser(port, args.timeout, admin)
+    else:
+        def new_user(admin=False):
+            return TestClientUser(app1, admin)
+
+    runners = {"scan": scan_scenario, "view": view_scenario, "export": export_scenario}
+    try:
+        for scenario in args.scenarios:
+            start = time.perf_counter()
+            results = runners[scenario](args, new_user, token)
+            summary = summarize(scenario, results, time.perf_counter() - start)
+            if scenario == "scan":
+                summary["within_expiry"] = summary["wall_s"] < app1.QR_TTL_SECONDS
+            print(RESULT_TAG + json.dumps(summary), flush=True)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+# ---------- parent ----------
+def run_pair(args, backend, transport, tmp):
+    env = dict(os.environ, DB_POOL_SIZE=str(args.pool_size), SCAN_WRITE_BEHIND="0",
+               SCAN_RATE_LIMIT="0", SCAN_ADDRESS_RATE_LIMIT="0")
+    env.pop("DATABASE_URL", None)
+    if backend == "postgres":
+        env["DATABASE_URL"] = args.postgres
+    else:
+        env["SQLITE_PATH"] = os.path.join(tmp, f"loadtest-{transport}.db")
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", "--transport", transport,
+           "--scenarios", ",".join(args.scenarios)] + args.passthrough
+    proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    results = [dict(json.loads(line[len(RESULT_TAG):]), backend=backend, transport=transport)
+               for line in proc.stdout.splitlines() if line.startswith(RESULT_TAG)]
+    if proc.returncode or not results:
+        raise RuntimeError(f"{backend}/{transport} load test failed (exit code {proc.returncode})")
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_table(results, baseline=None):
+    print(f"{'backend':<10}{'transport':<11}{'scenario':<9}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'err %':>7}{'lock %':>8}" + (f"{'req/s Δ':>10}{'p95 Δ':>9}" if baseline else ""))
+    for r in results:
+        line = (f"{r['backend']:<10}{r['transport']:<11}{r['scenario']:<9}{r['requests_per_s']:>9}"
+                f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}"
+                f"{r['error_rate'] * 100:>7.1f}{r['lock_rate'] * 100:>8.1f}")
+        old = (baseline or {}).get((r["backend"], r["transport"], r["scenario"]))
+        if old:
+            line += f"{change(old['requests_per_s'], r['requests_per_s']):>10}{change(old['p95_ms'], r['p95_ms']):>9}"
+        print(line)
+
+
+def change(old, new):
+    return f"{(new - old) / old * 100:+.0f}%" if old else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated: scan,view,export")
+    parser.add_argument("--transports", default=",".join(TRANSPORTS), help="comma-separated: client,http")
+    parser.add_argument("--students", type=int, default=300, help="scan POSTs in the burst")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent scanning clients")
+    parser.add_argument("--admins", type=int, default=10, help="concurrent admins paging /view")
+    parser.add_argument("--pages", type=int, default=5, help="pages each admin walks")
+    parser.add_argument("--exports", type=int, default=4, help="concurrent /export downloads")
+    parser.add_argument("--rows", type=int, default=20000, help="historical marks seeded before the run")
+    parser.add_argument("--pool-size", type=int, default=10, help="DB_POOL_SIZE for the app")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout in seconds (HTTP)")
+    parser.add_argument("--postgres", default=os.environ.get("DATABASE_URL"),
+                        help="also run against this Postgres URL (default: $DATABASE_URL)")
+    parser.add_argument("--out", help="save results to this JSON file")
+    parser.add_argument("--compare", help="JSON file from an earlier --out to compare against")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--transport", default="client", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(args.scenarios) - set(SCENARIOS) | set(args.transports.split(",")) - set(TRANSPORTS)
+    if unknown:
+        parser.error(f"unknown scenario or transport: {', '.join(sorted(unknown))}")
+
+    if args.child:
+        run_child(args)
+        return
+
+    args.passthrough = []
+    for name in ("students", "concurrency", "admins", "pages", "exports", "rows", "timeout"):
+        args.passthrough += [f"--{name}", str(getattr(args, name))]
+    backends = ["sqlite"] + (["postgres"] if args.postgres else [])
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in backends:
+            for transport in args.transports.split(","):
+                results += run_pair(args, backend, transport, tmp)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(r["backend"], r["transport"], r["scenario"]): r for r in json.load(f)["results"]}
+    print(f"{args.rows} seeded rows; scan: {args.students} students x {args.concurrency} clients; "
+          f"view: {args.admins} admins x {args.pages} pages; export: {args.exports} downloads\n")
+    print_table(results, baseline)
+
+    if args.out:
+        report = {
+            "revision": git_revision(),
+            "at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "settings": {k: v for k, v in vars(args).items()
+                         if k not in ("child", "transport", "passthrough", "postgres", "out", "compare")},
+            "results": results,
+        }
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nsaved {args.out}")
+    failed = sum(r["error"] + r["locked"] for r in results)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
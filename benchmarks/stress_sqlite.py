@@ -0,0 +1,150 @@
+"""Stress test: concurrent writers against the SQLite engine profile.
+
+Runs --writers threads (split across --processes worker processes sharing
+one database file) that all mark attendance at the same moment through the
+Flask test client, mixing /scan and /manual_add, while --readers threads
+page through /view. Any "database is locked" answer is counted as a lock
+error; the run fails if there is one.
+
+    python benchmarks/stress_sqlite.py --writers 200
+    python benchmarks/stress_sqlite.py --writers 200 --processes 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_ingest import RESULT_TAG, ROOT, percentile  # noqa: E402
+
+
+def run_child(args):
+    sys.path.insert(0, ROOT)
+    import app1
+
+    app1.app.testing = True
+    token = app1.issue_token(app1.QR_TOKEN_SECRET, "STRESS", "CSE-A", ttl=3600)
+    start_gate = threading.Barrier(args.writers + args.readers)
+    results = []
+    lock = threading.Lock()
+    stop_readers = threading.Event()
+
+    def outcome(resp):
+        body = resp.get_data(as_text=True)
+        if "locked" in body.lower():
+            return "locked"
+        if resp.status_code >= 400 or "Error" in body[:10]:
+            return "error"
+        return "ok"
+
+    def writer(i):
+        client = app1.app.test_client()
+        if i % 4 == 3:
+            with client.session_transaction() as sess:
+                sess["admin"] = True
+        start_gate.wait()
+        for j in range(args.marks):
+            roll = f"P{args.worker}-W{i}-{j}"
+            t = time.perf_counter()
+            if i % 4 == 3:
+                resp = client.post("/manual_add", data={"roll": roll, "name": "Stress", "subject": "STRESS",
+                                                        "branch": "CSE-A"})
+            else:
+                client = app1.app.test_client()  # fresh session per scan
+                resp = client.post(f"/scan?t={token}", data={"roll": roll, "name": "Stress", "device": roll})
+            with lock:
+                results.append(("write", time.perf_counter() - t, outcome(resp)))
+
+    def reader(i):
+        client = app1.app.test_client()
+        with client.session_transaction() as sess:
+            sess["admin"] = True
+        start_gate.wait()
+        while not stop_readers.is_set():
+            t = time.perf_counter()
+            resp = client.get("/view?sub=STRESS")
+            with lock:
+                results.append(("read", time.perf_counter() - t, outcome(resp)))
+
+    writers = [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    readers = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    start = time.perf_counter()
+    for t in writers + readers:
+        t.start()
+    for t in writers:
+        t.join()
+    wall = time.perf_counter() - start
+    stop_readers.set()
+    for t in readers:
+        t.join()
+
+    summary = {}
+    for kind in ("write", "read"):
+        rows = [r for r in results if r[0] == kind]
+        latencies = [r[1] for r in rows]
+        summary[kind] = {
+            "requests": len(rows),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            **{k: sum(1 for r in rows if r[2] == k) for k in ("ok", "locked", "error")},
+        }
+    summary["wall_s"] = round(wall, 3)
+    print(RESULT_TAG + json.dumps(summary), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=200, help="concurrent writer threads in total")
+    parser.add_argument("--readers", type=int, default=8, help="concurrent /view reader threads per process")
+    parser.add_argument("--marks", type=int, default=5, help="marks written by each writer")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes sharing the database")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SQLITE_PATH=os.path.join(tmp, "stress.db"), SCAN_WRITE_BEHIND="0",
+                   SCAN_RATE_LIMIT="0", SCAN_ADDRESS_RATE_LIMIT="0")
+        env.pop("DATABASE_URL", None)
+        # Create the schema once so workers don't race on the first migration
+        subprocess.run([sys.executable, "-c", "import app1"], cwd=ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        per_process = max(1, args.writers // args.processes)
+        procs = [subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--child", "--worker", str(n),
+             "--writers", str(per_process), "--readers", str(args.readers), "--marks", str(args.marks)],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            for n in range(args.processes)]
+        runs = []
+        for proc in procs:
+            out, _ = proc.communicate()
+            for line in out.splitlines():
+                if line.startswith(RESULT_TAG):
+                    runs.append(json.loads(line[len(RESULT_TAG):]))
+            if proc.returncode:
+                raise RuntimeError(f"stress worker failed (exit code {proc.returncode})")
+
+    print(f"{per_process * args.processes} writers x {args.marks} marks, "
+          f"{args.readers * args.processes} readers, {args.processes} process(es)\n")
+    print(f"{'kind':<8}{'requests':>10}{'ok':>8}{'locked':>8}{'error':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    locked = 0
+    for kind in ("write", "read"):
+        total = {k: sum(r[kind][k] for r in runs) for k in ("requests", "ok", "locked", "error")}
+        locked += total["locked"]
+        print(f"{kind:<8}{total['requests']:>10}{total['ok']:>8}{total['locked']:>8}{total['error']:>8}"
+              f"{max(r[kind]['p50_ms'] for r in runs):>10}{max(r[kind]['p99_ms'] for r in runs):>10}")
+    print(f"\nwall: {max(r['wall_s'] for r in runs)}s, lock errors: {locked}")
+    sys.exit(1 if locked else 0)
+
+
+if __name__ == "__main__":
+    main()
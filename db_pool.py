@@ -0,0 +1,191 @@
+"""Small thread-safe connection pool used by app1.get_db_connection().
+
+Works for both psycopg2 and sqlite3 connections: the pool only needs a
+factory that opens a new DB-API connection.
+"""
+import threading
+import time
+
+
+class PoolExhausted(Exception):
+    """Raised when no connection becomes free within the checkout timeout."""
+
+
+class PooledConnection:
+    """Wraps a real connection so that close() hands it back to the pool."""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+
+    @property
+    def raw(self):
+        return self._raw
+
+    @property
+    def released(self):
+        return self._released
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._raw)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """Bounded pool of reusable connections with checkout health checks.
+
+    max_size      - hard limit of open connections (idle + in use)
+    timeout       - seconds checkout() waits for a free connection
+    max_idle      - idle connections older than this are pinged before reuse
+    """
+
+    def __init__(self, factory, max_size=5, timeout=10.0, max_idle=30.0,
+                 ping_sql="SELECT 1", log=None, on_checkout=None):
+        self._factory = factory
+        self.max_size = max(1, int(max_size))
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._ping_sql = ping_sql
+        self._log = log or (lambda msg: None)
+        # on_checkout(seconds waited) after every successful checkout
+        self._on_checkout = on_checkout or (lambda seconds: None)
+        self._cond = threading.Condition()
+        self._idle = []  # list of (connection, last_used)
+        self._open = 0
+        self._stats = {
+            "created": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "timeouts": 0,
+            "discarded": 0,
+        }
+
+    def checkout(self):
+        """Return a PooledConnection, opening a new one if below max_size."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        while True:
+            stale = None
+            with self._cond:
+                while True:
+                    if self._idle:
+                        raw, last_used = self._idle.pop()
+                        if time.monotonic() - last_used < self.max_idle and not getattr(raw, "closed", 0):
+                            return self._checked_out(raw, start, waited)
+                        # Still counted as open; pinged below without holding
+                        # the lock, so other checkouts don't queue behind it
+                        stale = raw
+                        break
+                    if self._open < self.max_size:
+                        self._open += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolExhausted(
+                            f"no database connection available after {self.timeout}s "
+                            f"(max_size={self.max_size})")
+                    waited = True
+                    self._cond.wait(remaining)
+            if stale is None:
+                break
+            if self._ping(stale):
+                with self._cond:
+                    return self._checked_out(stale, start, waited)
+            self._discard(stale)
+
+        # Open the connection outside the lock; it may involve a TLS handshake
+        try:
+            raw = self._factory()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats["created"] += 1
+            self._log(f"DB POOL: opened connection ({self._open}/{self.max_size})")
+            return self._checked_out(raw, start, waited)
+
+    def release(self, raw):
+        """Return a connection to the pool, discarding it if it is broken."""
+        try:
+            # Never hand out a connection with a half-finished transaction
+            raw.rollback()
+            ok = not getattr(raw, "closed", 0)
+        except Exception:
+            ok = False
+        if not ok:
+            self._discard(raw)
+            return
+        with self._cond:
+            self._idle.append((raw, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        """Close every idle connection (in-use ones are closed on release)."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for raw, _ in idle:
+            self._discard(raw)
+
+    def stats(self):
+        with self._cond:
+            data = dict(self._stats)
+            data.update(
+                max_size=self.max_size,
+                open=self._open,
+                idle=len(self._idle),
+                in_use=self._open - len(self._idle),
+            )
+        data["wait_time_total"] = round(data["wait_time_total"], 6)
+        return data
+
+    # -- internals --
+
+    def _checked_out(self, raw, start, waited):
+        # Called with self._cond held
+        self._stats["checkouts"] += 1
+        elapsed = time.monotonic() - start
+        if waited:
+            self._stats["waits"] += 1
+            self._stats["wait_time_total"] += elapsed
+        self._on_checkout(elapsed)
+        return PooledConnection(self, raw)
+
+    def _ping(self, raw):
+        if getattr(raw, "closed", 0):
+            return False
+        try:
+            cur = raw.cursor()
+            cur.execute(self._ping_sql)
+            cur.fetchone()
+            cur.close()
+            raw.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, raw):
+        """Close a connection that counts as open (called without self._cond held)"""
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._open -= 1
+            self._stats["discarded"] += 1
+            self._cond.notify()
@@ -0,0 +1,60 @@
+"""Streaming CSV parser for bulk attendance uploads (/bulk_add).
+
+Rows are read one at a time from the uploaded file, so a roster of
+thousands of students is never held in memory as a whole. Columns are
+roll, name, branch, subject, date (subject and date optional); a header
+row naming the columns may list them in any order. Values missing from a
+row fall back to the defaults chosen on the upload form.
+"""
+import csv
+import datetime
+
+COLUMNS = ("roll", "name", "branch", "subject", "date")
+
+
+def _column_map(first_row):
+    """Column positions from a header row, or None if the row is data"""
+    names = [c.strip().lower() for c in first_row]
+    if "roll" not in names:
+        return None
+    return {col: names.index(col) for col in COLUMNS if col in names}
+
+
+def _valid_date(value):
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except ValueError:
+        return None
+
+
+def read_attendance_csv(text_stream, defaults):
+    """Yield (roll, name, date, time, subject, branch) per CSV line, or None for an invalid line.
+
+    defaults supplies "branch", "subject", "date" and "time" for values a
+    row leaves out.
+    """
+    reader = csv.reader(text_stream)
+    positions = None
+    for n, line in enumerate(reader):
+        if n == 0:
+            positions = _column_map(line)
+            if positions is not None:
+                continue
+            positions = {col: i for i, col in enumerate(COLUMNS)}
+        if not any(cell.strip() for cell in line):
+            continue
+
+        values = {col: line[i].strip() for col, i in positions.items() if i < len(line)}
+        roll = values.get("roll", "")
+        name = values.get("name", "")
+        date = values.get("date") or defaults.get("date") or ""
+        if not roll or not name or not date:
+            yield None
+            continue
+        date = _valid_date(date)
+        if date is None:
+            yield None
+            continue
+        yield (roll, name, date, defaults.get("time"),
+               values.get("subject") or defaults.get("subject") or None,
+               values.get("branch") or defaults.get("branch") or None)
@@ -0,0 +1,121 @@
+"""Write-behind ingestion queue for attendance marks.
+
+During a scan burst every /scan POST normally pays for its own commit.
+With the queue enabled, request threads hand their row to a background
+writer that commits rows in batches (one transaction per batch) and then
+wakes each waiting request with its own result, so a student is only told
+"marked" once the row is durably committed.
+"""
+import queue
+import threading
+import time
+
+
+class IngestTimeout(Exception):
+    """Raised when a queued mark is not committed within the wait timeout."""
+
+
+class _PendingMark:
+    __slots__ = ("request", "done", "result", "error")
+
+    def __init__(self, request):
+        self.request = request
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class WriteBehindQueue:
+    """Collects rows and writes them in batches on a background thread.
+
+    transaction - context manager factory yielding a cursor and committing on
+                  a clean exit (app1.db_writer)
+    write       - write(cursor, requests) -> list of (is_new, replayed), one per
+                  (idempotency key or None, row) request
+                  (AttendanceRepository.mark_requests)
+    max_batch   - flush once this many rows are waiting
+    max_delay   - flush at the latest this many seconds after the first row
+    """
+
+    def __init__(self, transaction, write, max_batch=100, max_delay=0.05, log=None):
+        self._transaction = transaction
+        self._write = write
+        self.max_batch = max(1, int(max_batch))
+        self.max_delay = max_delay
+        self._log = log or (lambda msg: None)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "written": 0, "batches": 0, "failed_batches": 0, "largest_batch": 0}
+
+    def mark(self, row, timeout=10.0, key=None):
+        """Queue a row and block until its batch commits.
+
+        Returns (is_new, replayed): is_new is True if the row was new, False
+        if it was a duplicate; replayed is True if key had already been
+        used, in which case is_new is that earlier request's result.
+        Re-raises the writer's exception if the batch failed.
+        """
+        pending = self.submit((key, row))
+        if not pending.done.wait(timeout):
+            raise IngestTimeout(f"attendance write not committed within {timeout}s")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def submit(self, request):
+        self._ensure_started()
+        pending = _PendingMark(request)
+        with self._lock:
+            self._stats["submitted"] += 1
+        self._queue.put(pending)
+        return pending
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data.update(pending=self._queue.qsize(), max_batch=self.max_batch, max_delay=self.max_delay)
+        return data
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            with self._transaction() as c:
+                results = self._write(c, [p.request for p in batch])
+        except Exception as e:
+            self._log(f"INGEST: batch of {len(batch)} failed: {e}")
+            with self._lock:
+                self._stats["failed_batches"] += 1
+            for p in batch:
+                p.error = e
+                p.done.set()
+            return
+
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["written"] += sum(1 for is_new, replayed in results if is_new and not replayed)
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+        for p, result in zip(batch, results):
+            p.result = result
+            p.done.set()
@@ -0,0 +1,79 @@
+"""In-memory live attendance feed for the admin dashboard.
+
+While a QR is on screen, scan() records every new mark here, keyed by
+(subject, branch, date). The admin page reads the running count and the
+most recent rolls from memory, so watching a class check in does not
+query the attendance table. A session's count is seeded once from the
+database (see app1.live_feed) and only counts up in memory after that.
+"""
+import collections
+import threading
+import time
+
+
+class LiveAttendance:
+    def __init__(self, recent_size=20, max_sessions=200):
+        self.recent_size = recent_size
+        self.max_sessions = max_sessions
+        self._sessions = collections.OrderedDict()  # key -> dict
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(subject, branch, date):
+        return (subject or "", branch or "", date)
+
+    def has(self, subject, branch, date):
+        with self._lock:
+            return self.key(subject, branch, date) in self._sessions
+
+    def record(self, subject, branch, date, roll, name, seed=None):
+        """Count one committed mark. seed() returns the stored count for an unseen session."""
+        key = self.key(subject, branch, date)
+        with self._lock:
+            entry = self._sessions.get(key)
+        created = entry is None
+        if created:
+            # The mark is already committed, so a fresh seed includes it
+            entry = self._create(key, seed)
+        with self._lock:
+            if not created or seed is None:
+                entry["count"] += 1
+            entry["version"] += 1
+            entry["updated"] = time.time()
+            entry["recent"].appendleft({"roll": roll, "name": name, "at": time.strftime("%H:%M:%S")})
+
+    def snapshot(self, subject, branch, date, seed=None):
+        key = self.key(subject, branch, date)
+        with self._lock:
+            entry = self._sessions.get(key)
+        if entry is None:
+            entry = self._create(key, seed)
+        with self._lock:
+            return {
+                "subject": key[0],
+                "branch": key[1],
+                "date": key[2],
+                "count": entry["count"],
+                "version": entry["version"],
+                "recent": list(entry["recent"]),
+            }
+
+    def forget(self, subject="", branch=""):
+        """Drop sessions matching a delete/clear scope so they are re-seeded"""
+        with self._lock:
+            for key in list(self._sessions):
+                if (not subject or key[0] == subject) and (not branch or key[1] == branch):
+                    del self._sessions[key]
+
+    def _create(self, key, seed):
+        # Seed outside the lock: it may hit the database
+        count = seed() if seed else 0
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                entry = {"count": count, "version": 0, "updated": time.time(),
+                         "recent": collections.deque(maxlen=self.recent_size)}
+                self._sessions[key] = entry
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            return entry
@@ -0,0 +1,151 @@
+"""In-process metrics with a Prometheus text endpoint.
+
+Counters and histograms are plain dicts behind a lock, cheap enough to
+update on every request and query. app1 serves them at /metrics in the
+Prometheus text format, so any scraper (or curl) can read them without
+an extra dependency. Gauges are computed when scraped, from callbacks
+such as the connection pool's stats().
+
+SlowLog replaces logging every query: only queries over a threshold are
+logged, and each statement at most once per interval, with a count of
+the ones suppressed in between.
+"""
+import threading
+import time
+
+# Seconds; covers a cached page (sub-millisecond) up to a large export
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(entry)) for labels, entry in self._values.items())
+        for labels, entry in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, entry):
+                cumulative += n
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, [le])} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labels, labels, [le])} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {round(entry[-2], 6)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {entry[-1]}")
+        return lines
+
+
+class Gauges:
+    """Values read at scrape time: read() returns {name: value} for one prefix"""
+
+    def __init__(self, prefix, help, read):
+        self.prefix, self.help, self.read = prefix, help, read
+
+    def render(self):
+        lines = []
+        for key, value in sorted(self.read().items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                name = f"{self.prefix}_{key}"
+                lines += [f"# HELP {name} {self.help} ({key})", f"# TYPE {name} gauge", f"{name} {_number(value)}"]
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauges(self, prefix, help, read):
+        return self._add(Gauges(prefix, help, read))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class SlowLog:
+    """Log queries slower than threshold seconds, each key at most once per interval"""
+
+    def __init__(self, threshold, interval, log):
+        self.threshold = threshold
+        self.interval = interval
+        self.log = log
+        self._last = {}  # key -> (logged_at, suppressed)
+        self._lock = threading.Lock()
+
+    def check(self, key, seconds, detail):
+        if seconds < self.threshold:
+            return
+        now = time.monotonic()
+        with self._lock:
+            logged_at, suppressed = self._last.get(key, (None, 0))
+            if logged_at is not None and now - logged_at < self.interval:
+                self._last[key] = (logged_at, suppressed + 1)
+                return
+            self._last[key] = (now, 0)
+        more = f" (+{suppressed} more since last logged)" if suppressed else ""
+        self.log(f"SLOW QUERY {key}: {seconds * 1000:.1f} ms{more}: {detail}")
@@ -0,0 +1,103 @@
+"""QR code rendering with an in-process LRU cache.
+
+Faculty refresh /generate and several classes start at the same time, so
+the same QR image is requested many times while it is valid. Rendered
+images are cached by (url, format, size, error correction) until the QR
+expires. SVG output is written straight from the module matrix, which
+skips Pillow's PNG encoder entirely.
+
+qrcode (and Pillow behind it) is imported on the first render rather
+than with this module, so a cold start that never draws a QR skips it.
+"""
+import collections
+import io
+import threading
+import time
+
+# qrcode.constants.ERROR_CORRECT_*, spelled out to avoid importing qrcode
+ERROR_LEVELS = {"L": 1, "M": 0, "Q": 3, "H": 2}
+MIMETYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+def _matrix(url, ec):
+    import qrcode
+    qr = qrcode.QRCode(error_correction=ERROR_LEVELS[ec], border=4)
+    qr.add_data(url)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def _svg(matrix, box_size):
+    n = len(matrix)
+    path = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < n:
+            if row[x]:
+                start = x
+                while x < n and row[x]:
+                    x += 1
+                path.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+            else:
+                x += 1
+    px = n * box_size
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{px}" height="{px}" '
+            f'viewBox="0 0 {n} {n}" shape-rendering="crispEdges">'
+            f'<rect width="{n}" height="{n}" fill="#fff"/>'
+            f'<path fill="#000" d="{"".join(path)}"/></svg>').encode()
+
+
+def render_qr(url, fmt="png", box_size=10, ec="M"):
+    """Render url as a QR image and return the encoded bytes"""
+    if fmt == "svg":
+        return _svg(_matrix(url, ec), box_size)
+    import qrcode
+    img = qrcode.make(url, box_size=box_size, error_correction=ERROR_LEVELS[ec])
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class QRCache:
+    """Thread-safe LRU of rendered QR images with a per-entry expiry time"""
+
+    def __init__(self, max_entries=256, observe=None):
+        self.max_entries = max_entries
+        # observe(fmt, seconds) after each render
+        self.observe = observe or (lambda fmt, seconds: None)
+        self._entries = collections.OrderedDict()  # key -> (expires_at, bytes)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get_or_render(self, url, fmt="png", box_size=10, ec="M", expires_at=None):
+        key = (url, fmt, box_size, ec)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and (entry[0] is None or entry[0] > now):
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[1]
+            self._stats["misses"] += 1
+
+        # Render outside the lock; two concurrent misses just render twice
+        start = time.perf_counter()
+        data = render_qr(url, fmt, box_size, ec)
+        self.observe(fmt, time.perf_counter() - start)
+        with self._lock:
+            self._entries[key] = (expires_at, data)
+            self._entries.move_to_end(key)
+            self._evict(now)
+        return data
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), max_entries=self.max_entries)
+
+    def _evict(self, now):
+        expired = [k for k, (exp, _) in self._entries.items() if exp is not None and exp <= now]
+        for k in expired:
+            del self._entries[k]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
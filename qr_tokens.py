@@ -0,0 +1,106 @@
+"""Signed, stateless QR tokens.
+
+A token carries everything /scan needs to accept a mark - a random QR
+session id, subject, branch, issue time and expiry (epoch seconds) - and
+an HMAC-SHA256 tag over them. Verification is a single HMAC and a
+constant-time compare, so forged or expired QR links are rejected
+without touching the database.
+
+Rotating QR codes reuse the same format: step_token() derives a short
+lived token for each time step of a QR session, so verification is
+unchanged and needs no per-token storage.
+
+Format: base64url(json payload) "." base64url(truncated HMAC)
+"""
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import time
+
+SIG_BYTES = 16
+
+
+class InvalidToken(Exception):
+    """Token is malformed or its signature does not match."""
+
+
+class TokenExpired(InvalidToken):
+    """Token signature is valid but its expiry has passed."""
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(secret, body):
+    return hmac.new(secret, body.encode(), hashlib.sha256).digest()[:SIG_BYTES]
+
+
+def _encode(secret, payload):
+    body = _b64encode(json.dumps(payload, separators=(",", ":")).encode())
+    return f"{body}.{_b64encode(_sign(secret, body))}"
+
+
+def issue_token(secret, subject, branch, ttl, now=None, session_id=None):
+    """Return a token for one QR session valid for ttl seconds"""
+    now = int(time.time() if now is None else now)
+    return _encode(secret, {
+        "sid": session_id or _b64encode(secrets.token_bytes(6)),
+        "sub": subject or "",
+        "br": branch or "",
+        "iat": now,
+        "exp": now + int(ttl),
+    })
+
+
+def step_token(secret, session, step_seconds, now=None):
+    """Token for the current time step of a rotating QR session.
+
+    session is a verified payload (sid/sub/br/exp). The token for a given
+    step is deterministic, so every worker and every projector screen shows
+    the same code without shared state, and it stays valid for one extra
+    step so a student who scans just before rotation can still open the
+    scan page (which then hands out a longer-lived form token, see
+    app1.scan_form_token).
+
+    Returns (token, step, next_rotation_epoch).
+    """
+    now = time.time() if now is None else now
+    step_seconds = int(step_seconds)
+    step = int(now // step_seconds)
+    iat = step * step_seconds
+    token = _encode(secret, {
+        "sid": session["sid"],
+        "sub": session["sub"],
+        "br": session["br"],
+        "iat": iat,
+        "exp": min(iat + 2 * step_seconds, int(session["exp"])),
+    })
+    return token, step, iat + step_seconds
+
+
+def verify_token(secret, token, now=None):
+    """Return the token payload, raising InvalidToken or TokenExpired"""
+    if not token or token.count(".") != 1:
+        raise InvalidToken("malformed token")
+    body, sig = token.split(".")
+    try:
+        given = _b64decode(sig)
+    except ValueError:
+        raise InvalidToken("malformed signature")
+    if not hmac.compare_digest(given, _sign(secret, body)):
+        raise InvalidToken("bad signature")
+    try:
+        payload = json.loads(_b64decode(body))
+        exp = int(payload["exp"])
+    except (ValueError, KeyError, TypeError):
+        raise InvalidToken("malformed payload")
+    if (time.time() if now is None else now) > exp:
+        raise TokenExpired("token expired")
+    return payload
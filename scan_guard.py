@@ -0,0 +1,199 @@
+"""In-memory checks that answer abusive or repeated scans without the database.
+
+Two things are kept per process, or in a SQLite file shared by the
+processes on one host:
+
+- a sliding-window attempt counter per key (app1 counts each roll in a QR
+  session, each device and each client address), so a client retrying in
+  a loop is turned away after `limit` attempts per `window` seconds;
+- the set of recently marked (class, roll) and (class, device) keys,
+  filled from committed scans, so a repeat scan is answered "already
+  marked" without a duplicate query.
+
+The marked set is exact (an LRU with a TTL, not a Bloom filter): a false
+positive would turn away a student who has not marked yet. It only ever
+holds scans the database has accepted or reported as duplicates, and
+app1 forgets a scope whenever its records are deleted.
+"""
+import collections
+import sqlite3
+import threading
+import time
+
+ANY = ""  # subject/branch wildcard, as in the /view filters
+
+
+def _matches(scope, subject, branch):
+    return (not subject or scope[0] == subject) and (not branch or scope[1] == branch)
+
+
+class MemoryGuardStore:
+    """Attempt windows and marked keys held in this process"""
+
+    def __init__(self, max_keys=50000):
+        self.max_keys = max_keys
+        self._windows = collections.OrderedDict()  # key -> [slot, hits, hits in previous slot]
+        self._marked = collections.OrderedDict()   # key -> (scope, expires_at)
+        self._lock = threading.Lock()
+
+    def _trim(self, entries):
+        while len(entries) > self.max_keys:
+            entries.popitem(last=False)
+
+    def count(self, key, slot):
+        """Record an attempt in slot; returns (hits in slot, hits in slot - 1)"""
+        with self._lock:
+            entry = self._windows.get(key)
+            if entry is None or entry[0] < slot - 1:
+                entry = [slot, 0, 0]
+            elif entry[0] == slot - 1:
+                entry = [slot, 0, entry[1]]
+            entry[1] += 1
+            self._windows[key] = entry
+            self._windows.move_to_end(key)
+            self._trim(self._windows)
+            return entry[1], entry[2]
+
+    def marked(self, key, now):
+        with self._lock:
+            entry = self._marked.get(key)
+            if entry is None:
+                return False
+            if entry[1] <= now:
+                del self._marked[key]
+                return False
+            self._marked.move_to_end(key)
+            return True
+
+    def mark(self, keys, scope, expires_at):
+        with self._lock:
+            for key in keys:
+                self._marked[key] = (scope, expires_at)
+                self._marked.move_to_end(key)
+            self._trim(self._marked)
+
+    def forget(self, subject, branch):
+        with self._lock:
+            for key in [k for k, (scope, _) in self._marked.items() if _matches(scope, subject, branch)]:
+                del self._marked[key]
+
+    def size(self):
+        with self._lock:
+            return {"windows": len(self._windows), "marked": len(self._marked)}
+
+
+class SQLiteGuardStore:
+    """Attempt windows and marked keys in a SQLite file shared by the processes on one host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._cleaned_slot = None
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS scan_windows (
+                    key TEXT NOT NULL, slot INTEGER NOT NULL, hits INTEGER NOT NULL,
+                    PRIMARY KEY (key, slot))
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS scan_marked (
+                    key TEXT PRIMARY KEY, subject TEXT NOT NULL, branch TEXT NOT NULL, expires_at REAL NOT NULL)
+            """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def count(self, key, slot):
+        conn = self._conn()
+        with conn:
+            if self._cleaned_slot != slot:
+                # Once per window per process: drop windows and marks nobody can hit any more
+                self._cleaned_slot = slot
+                conn.execute("DELETE FROM scan_windows WHERE slot < ?", (slot - 1,))
+                conn.execute("DELETE FROM scan_marked WHERE expires_at <= ?", (time.time(),))
+            conn.execute("""
+                INSERT INTO scan_windows VALUES (?, ?, 1)
+                ON CONFLICT (key, slot) DO UPDATE SET hits = hits + 1
+            """, (key, slot))
+            hits = dict(conn.execute("SELECT slot, hits FROM scan_windows WHERE key = ? AND slot >= ?",
+                                     (key, slot - 1)))
+        return hits.get(slot, 0), hits.get(slot - 1, 0)
+
+    def marked(self, key, now):
+        return self._conn().execute("SELECT 1 FROM scan_marked WHERE key = ? AND expires_at > ?",
+                                    (key, now)).fetchone() is not None
+
+    def mark(self, keys, scope, expires_at):
+        conn = self._conn()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO scan_marked VALUES (?, ?, ?, ?)",
+                             [(key, scope[0], scope[1], expires_at) for key in keys])
+
+    def forget(self, subject, branch):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM scan_marked WHERE (? = '' OR subject = ?) AND (? = '' OR branch = ?)",
+                         (subject, subject, branch, branch))
+
+    def size(self):
+        conn = self._conn()
+        return {"windows": conn.execute("SELECT COUNT(*) FROM scan_windows").fetchone()[0],
+                "marked": conn.execute("SELECT COUNT(*) FROM scan_marked").fetchone()[0]}
+
+
+class ScanGuard:
+    """Sliding-window rate limit plus a TTL'd set of recently marked scans"""
+
+    def __init__(self, limit=10, window=60, ttl=600, store=None):
+        self.limit = limit
+        self.window = window
+        self.ttl = ttl
+        self.store = store or MemoryGuardStore()
+        self._stats = {"allowed": 0, "limited": 0, "marked_hits": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def allow(self, key, limit=None):
+        """Count an attempt by key; False once it is over limit (default self.limit) for the last window seconds"""
+        limit = self.limit if limit is None else limit
+        if limit <= 0:
+            return True
+        now = time.time()
+        slot, into = divmod(now, self.window)
+        current, previous = self.store.count(key, int(slot))
+        # Sliding window approximated from two fixed ones: the previous
+        # window's hits count in proportion to how much of it still overlaps
+        allowed = current + previous * (1 - into / self.window) <= limit
+        self._count("allowed" if allowed else "limited")
+        return allowed
+
+    def marked(self, key):
+        if self.ttl <= 0:
+            return False
+        found = self.store.marked(key, time.time())
+        if found:
+            self._count("marked_hits")
+        return found
+
+    def mark(self, keys, subject=ANY, branch=ANY):
+        """Remember keys as marked in the (subject, branch) scope for ttl seconds"""
+        if self.ttl > 0 and keys:
+            self.store.mark(keys, (subject or ANY, branch or ANY), time.time() + self.ttl)
+
+    def forget(self, subject=ANY, branch=ANY):
+        """Drop marked keys in a scope after its records changed ('' matches any)"""
+        self.store.forget(subject or ANY, branch or ANY)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, **self.store.size(), limit=self.limit, window=self.window)
@@ -0,0 +1,27 @@
+"""Shared setup: the app under test runs on a throwaway SQLite database."""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Before app1 is imported: it connects and migrates at import time
+_tmp = tempfile.mkdtemp(prefix="qr-attendance-tests-")
+os.environ.pop("DATABASE_URL", None)
+os.environ["SQLITE_PATH"] = os.path.join(_tmp, "attendance.db")
+os.environ["SCAN_WRITE_BEHIND"] = "0"
+os.environ.pop("SCAN_GUARD_SHARED_PATH", None)
+
+
+@pytest.fixture
+def app1(monkeypatch):
+    import app1 as module
+    from scan_guard import ScanGuard
+    # A fresh limiter and marked set per test
+    monkeypatch.setattr(module, "scan_guard", ScanGuard(limit=module.SCAN_RATE_LIMIT,
+                                                        window=module.SCAN_RATE_WINDOW,
+                                                        ttl=module.SCAN_RECENT_TTL))
+    return module
@@ -0,0 +1,87 @@
+"""Legacy SQLite dates that name a day that doesn't exist become NULL on migration."""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+from conftest import ROOT
+
+RESULT_TAG = "RESULT "
+
+# Runs in a fresh process, so app1 migrates the prepared file on import
+MIGRATE_AND_PAGE = f"""
+import json
+import app1
+conn = app1.get_db_connection()
+c = conn.cursor()
+pages, after = [], None
+while len(pages) < 10:
+    rows = app1.attendance_db.page(c, {{}}, after=after, limit=3)
+    pages.append([r[0] for r in rows[:2]])
+    if len(rows) <= 2:
+        break
+    after = app1.parse_view_cursor(app1.format_view_cursor(rows[1]))
+print({RESULT_TAG!r} + json.dumps(pages))
+"""
+
+
+def migrate(path):
+    env = dict(os.environ, SQLITE_PATH=str(path), AUTO_MIGRATE="1")
+    env.pop("DATABASE_URL", None)
+    proc = subprocess.run([sys.executable, "-c", MIGRATE_AND_PAGE], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=False)
+    assert proc.returncode == 0, proc.stderr
+    line = next(line for line in proc.stdout.splitlines() if line.startswith(RESULT_TAG))
+    return json.loads(line[len(RESULT_TAG):])
+
+
+ROWS = [("R1", "2025-02-27", "09:00:00"), ("R2", "2025-02-30", "10:00:00"),
+        ("R3", "2025-03-01", "24:00:00"), ("R4", "2025-03-02", "11:00:00")]
+
+
+def check_migrated(path, pages):
+    conn = sqlite3.connect(path)
+    dates = dict(conn.execute("SELECT roll, date FROM attendance WHERE deleted_at IS NULL"))
+    times = dict(conn.execute("SELECT roll, time FROM attendance WHERE deleted_at IS NULL"))
+    assert dates == {"R1": "2025-02-27", "R2": None, "R3": "2025-03-01", "R4": "2025-03-02"}
+    assert times["R3"] is None
+    held = [r[0] for r in conn.execute("SELECT date FROM sessions_held ORDER BY date")]
+    assert "2025-02-30" not in held
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO attendance (roll, date, time) VALUES ('R9', '2025-02-30', '10:00:00')")
+    # Paging reaches every row: dated newest first, then the NULLed ones
+    assert pages == [["R4", "R1"], ["R3", "R2"]]
+
+
+def test_text_dates_from_the_first_schema(tmp_path):
+    path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE attendance (roll TEXT, name TEXT, date TEXT, time TEXT, subject TEXT, branch TEXT)")
+    conn.executemany("INSERT INTO attendance VALUES (?, 'Student', ?, ?, 'DBMS', 'CSE-A')", ROWS)
+    conn.commit()
+    conn.close()
+    check_migrated(path, migrate(path))
+
+
+def test_dates_kept_under_the_old_check(tmp_path):
+    # Schema version 3 checked `date IS date(date)`, which lets '2025-02-30' in
+    path = tmp_path / "v3.db"
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE attendance (roll TEXT, date DATE CHECK (date IS date(date)),
+                    time TIME CHECK (time IS time(time)), subject TEXT, branch TEXT,
+                    id INTEGER PRIMARY KEY, deleted_at INTEGER)""")
+    conn.executemany("INSERT INTO attendance (id, roll, date, time, subject, branch) VALUES (?, ?, ?, ?, 'DBMS', 'CSE-A')",
+                     [(10 * (i + 1), *row) for i, row in enumerate(ROWS)])
+    conn.execute("INSERT INTO attendance VALUES ('R5', '2025-03-02', '12:00:00', 'DBMS', 'CSE-A', 50, 1)")
+    conn.execute("CREATE TABLE schema_version (version INTEGER PRIMARY KEY, applied_at TEXT)")
+    conn.execute("INSERT INTO schema_version VALUES (3, '2026-01-01T00:00:00')")
+    conn.commit()
+    conn.close()
+    check_migrated(path, migrate(path))
+    conn = sqlite3.connect(path)
+    # Ids and tombstones survive the rebuild
+    assert conn.execute("SELECT id, roll FROM attendance ORDER BY id").fetchall() == [
+        (10, "R1"), (20, "R2"), (30, "R3"), (40, "R4"), (50, "R5")]
+    assert conn.execute("SELECT deleted_at FROM attendance WHERE id = 50").fetchone() == (1,)
@@ -0,0 +1,52 @@
+"""Scan rate limits: a class behind one address gets in, a looping client does not."""
+
+
+def scan(app1, token, roll, **form):
+    # A fresh client per scan, as every student brings their own phone
+    client = app1.app.test_client()
+    return client.post("/scan?t=" + token, data={"roll": roll, "name": f"Student {roll}", **form})
+
+
+def form_token(app1, subject, branch):
+    return app1.scan_form_token(app1.issue_token(app1.QR_TOKEN_SECRET, subject, branch, ttl=600))
+
+
+def marked(app1, subject, branch):
+    conn = app1.get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*) FROM attendance WHERE subject=? AND branch=? AND deleted_at IS NULL",
+              (subject, branch))
+    count = c.fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_class_burst_from_one_address_is_not_limited(app1):
+    # 300 students on the campus Wi-Fi scan the same QR within a minute
+    token = form_token(app1, "BURST", "CSE-A")
+    statuses = [scan(app1, token, f"B{i:03d}", device=f"phone-{i}").status_code for i in range(300)]
+    assert statuses.count(200) == 300
+    assert marked(app1, "BURST", "CSE-A") == 300
+
+
+def test_one_roll_retrying_is_limited(app1):
+    token = form_token(app1, "LOOP", "CSE-A")
+    statuses = [scan(app1, token, "L001", device=f"fresh-{i}").status_code
+                for i in range(app1.SCAN_RATE_LIMIT + 5)]
+    assert statuses[:app1.SCAN_RATE_LIMIT] == [200] * app1.SCAN_RATE_LIMIT
+    assert statuses[app1.SCAN_RATE_LIMIT:] == [429] * 5
+
+
+def test_one_device_trying_rolls_is_limited(app1):
+    token = form_token(app1, "DEVICE", "CSE-A")
+    statuses = [scan(app1, token, f"D{i:03d}", device="same-phone").status_code
+                for i in range(app1.SCAN_RATE_LIMIT + 1)]
+    assert statuses[-1] == 429
+
+
+def test_address_backstop_catches_invented_rolls_and_devices(app1, monkeypatch):
+    monkeypatch.setattr(app1, "SCAN_ADDRESS_RATE_LIMIT", 20)
+    token = form_token(app1, "FLOOD", "CSE-A")
+    statuses = [scan(app1, token, f"F{i:03d}", device=f"invented-{i}").status_code for i in range(30)]
+    assert statuses.count(200) == 20
+    assert statuses[20:] == [429] * 10
@@ -0,0 +1,143 @@
+"""Versioned cache of rendered /view and /student_view pages.
+
+The same record pages are fetched over and over between writes. Each page
+is cached under its query plus the generation of the (subject, branch)
+scope it shows. Every write bumps the generations it touches (see
+app1.attendance_marked and friends), so a cached page is never served
+after a change to its scope; nothing has to be found and deleted.
+
+Generations are counted per process by default. With a shared SQLite
+file, worker processes on one host see each other's bumps and the
+in-process entries stay exact across workers too.
+"""
+import collections
+import hashlib
+import sqlite3
+import threading
+import time
+
+ANY = ""          # subject/branch wildcard, as in the /view filters
+_EPOCH = "*"      # bumped by writes that may touch any scope
+
+
+def _scope(subject, branch):
+    return f"{subject or ANY}\x1f{branch or ANY}"
+
+
+def _touched(subject, branch):
+    """Scopes whose pages can change when (subject, branch) changes"""
+    subject, branch = subject or ANY, branch or ANY
+    return {_scope(subject, branch), _scope(subject, ANY), _scope(ANY, branch), _scope(ANY, ANY)}
+
+
+class MemoryGenerations:
+    """Generation counters held in this process"""
+
+    def __init__(self):
+        # Start from the clock so ETags differ between processes and restarts
+        self._start = time.time_ns()
+        self._gens = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+    def get(self, scopes):
+        with self._lock:
+            return tuple(self._start + self._gens[s] for s in scopes)
+
+    def bump(self, scopes):
+        with self._lock:
+            for s in scopes:
+                self._gens[s] += 1
+
+
+class SQLiteGenerations:
+    """Generation counters in a SQLite file shared by the processes on one host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_generations (scope TEXT PRIMARY KEY, gen INTEGER NOT NULL)")
+            # Seed the epoch from the clock so a recreated file can't repeat old ETags
+            conn.execute("INSERT OR IGNORE INTO cache_generations VALUES (?, ?)", (_EPOCH, time.time_ns()))
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, scopes):
+        rows = dict(self._conn().execute(
+            f"SELECT scope, gen FROM cache_generations WHERE scope IN ({','.join(['?'] * len(scopes))})", scopes))
+        return tuple(rows.get(s, 0) for s in scopes)
+
+    def bump(self, scopes):
+        conn = self._conn()
+        with conn:
+            conn.executemany("""
+                INSERT INTO cache_generations VALUES (?, 1)
+                ON CONFLICT (scope) DO UPDATE SET gen = gen + 1
+            """, [(s,) for s in scopes])
+
+
+class ResponseCache:
+    """Thread-safe LRU of rendered pages, each valid for one scope version"""
+
+    def __init__(self, max_entries=256, ttl=60, generations=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generations = generations or MemoryGenerations()
+        self._entries = collections.OrderedDict()  # key -> (expires_at, version, etag, body)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def version(self, subject=ANY, branch=ANY):
+        """Current version of the pages showing (subject, branch)"""
+        return self.generations.get((_EPOCH, _scope(subject, branch)))
+
+    def changed(self, subject=ANY, branch=ANY):
+        """Record a write to one (subject, branch) scope"""
+        self.generations.bump(_touched(subject, branch))
+        with self._lock:
+            self._stats["invalidations"] += 1
+
+    def changed_all(self):
+        """Record a write that may touch any scope"""
+        self.generations.bump((_EPOCH,))
+        with self._lock:
+            self._stats["invalidations"] += 1
+
+    @staticmethod
+    def etag(key, version):
+        return hashlib.sha256(repr((key, version)).encode()).hexdigest()[:32]
+
+    def get_or_render(self, key, version, render):
+        """Return (body, etag) for key at version, calling render() on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] == version and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[3], entry[2]
+            self._stats["misses"] += 1
+
+        # Render outside the lock; two concurrent misses just render twice
+        body = render()
+        etag = self.etag(key, version)
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[key] = (now + self.ttl, version, etag, body)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats["evictions"] += 1
+        return body, etag
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), max_entries=self.max_entries)